@@ -0,0 +1,54 @@
+"""Étape de build (sur l'hôte): pages précompressées et modules précompilés en .mpy
+
+    python build.py
+
+Produit build/, à copier tel quel sur l'ESP32 (par exemple: mpremote cp -r build/. :).
+Nécessite mpy-cross (pip install mpy-cross), de la même version que le firmware.
+"""
+import gzip
+import os
+import shutil
+import subprocess
+import sys
+
+MODULES = ("filters", "encoding", "store", "sensor", "dosing", "injection", "server")
+ENTRY = "micropython_code(pompe).py"  # Devient main.py sur la carte
+WWW_DIR = "www"
+BUILD_DIR = "build"
+
+def mpy_cross_command():
+    """Exécutable mpy-cross, ou le module Python du paquet pip"""
+    if shutil.which("mpy-cross"):
+        return ["mpy-cross"]
+    return [sys.executable, "-m", "mpy_cross"]
+
+def gzip_pages():
+    """Compresse chaque page de www/ (mtime nul: même fichier, même ETag côté navigateur)"""
+    os.makedirs(os.path.join(BUILD_DIR, WWW_DIR), exist_ok=True)
+    for name in sorted(os.listdir(WWW_DIR)):
+        if not name.endswith(".html"):
+            continue
+        path = os.path.join(WWW_DIR, name)
+        with open(path, "rb") as f:
+            data = f.read()
+        compressed = gzip.compress(data, 9, mtime=0)
+        with open(path + ".gz", "wb") as f:
+            f.write(compressed)
+        shutil.copy(path, os.path.join(BUILD_DIR, WWW_DIR, name))
+        shutil.copy(path + ".gz", os.path.join(BUILD_DIR, WWW_DIR, name + ".gz"))
+        print(f"🗜️ {path}: {len(data)} o -> {len(compressed)} o")
+
+def compile_modules():
+    """Précompile les modules: ni analyse ni compilation du source au démarrage de la carte"""
+    command = mpy_cross_command()
+    for module in MODULES:
+        source = module + ".py"
+        target = os.path.join(BUILD_DIR, module + ".mpy")
+        subprocess.run(command + ["-o", target, source], check=True)
+        print(f"📦 {source}: {os.path.getsize(source)} o -> {target}: {os.path.getsize(target)} o")
+    shutil.copy(ENTRY, os.path.join(BUILD_DIR, "main.py"))
+
+if __name__ == "__main__":
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    gzip_pages()
+    compile_modules()
@@ -0,0 +1,221 @@
+"""Dosage: insuline active, profils compilés et recommandation de dose"""
+import math
+import time
+from array import array
+
+import store
+from store import H_DOSE, H_TIMESTAMP, find_user, history_search, iter_injection_history, mark_users_dirty
+
+# Paramètres pour le calcul d'insuline (profil par défaut)
+TARGET_GLUCOSE = 100
+INSULIN_SENSITIVITY = 50
+CARB_RATIO = 15
+CORRECTION_THRESHOLD = 140  # Pas de correction en dessous (mg/dL)
+CARBS_MAX_G = 250           # Repas saisi au tableau de bord: au-delà, faute de frappe probable
+
+# Tables de décision compilées (index = glycémie bornée à [GLUCOSE_MIN, GLUCOSE_MAX])
+GLUCOSE_MIN = 20
+GLUCOSE_MAX = 400
+GLUCOSE_STATUSES = (
+    ("HYPOGLYCÉMIE", "#ef4444", "⚠️"),
+    ("NORMAL", "#10b981", "✅"),
+    ("ÉLEVÉ", "#f59e0b", "⚡"),
+    ("HYPERGLYCÉMIE", "#dc2626", "🚨"))
+status_table = None         # bytearray: index dans GLUCOSE_STATUSES
+compiled_profiles = {}      # {username: (segment par heure, tables de correction, ratios glucidiques)}
+
+# Insuline active (IOB): modèle exponentiel précalculé en table d'entiers
+INSULIN_DIA_MIN = 240      # Durée d'action de l'insuline
+INSULIN_PEAK_MIN = 75      # Pic d'activité
+IOB_STEP_MIN = 5           # Pas de la table
+IOB_SCALE = 10000          # Fraction restante exprimée sur 10000
+iob_table = None           # array('H'), construite une fois au démarrage
+active_doses = {}          # {username: [(timestamp, dose en mU), ...]} injections encore actives
+
+def build_iob_table():
+    """Précalcule la fraction d'insuline restante (modèle exponentiel) tous les IOB_STEP_MIN"""
+    global iob_table
+    td = INSULIN_DIA_MIN
+    tp = INSULIN_PEAK_MIN
+    tau = tp * (1 - tp / td) / (1 - 2 * tp / td)
+    a = 2 * tau / td
+    S = 1 / (1 - a + (1 + a) * math.exp(-td / tau))
+    
+    iob_table = array('H', [0] * (td // IOB_STEP_MIN + 1))
+    for i in range(len(iob_table) - 1):
+        t = i * IOB_STEP_MIN
+        remaining = 1 - S * (1 - a) * ((t * t / (tau * td * (1 - a)) - t / tau - 1) * math.exp(-t / tau) + 1)
+        iob_table[i] = int(max(0, min(1, remaining)) * IOB_SCALE + 0.5)
+    # Dernière case: plus rien d'actif à la fin de la durée d'action
+    iob_table[-1] = 0
+
+def iob_fraction(elapsed_s):
+    """Fraction restante (sur IOB_SCALE) après elapsed_s secondes, interpolée en entiers"""
+    if elapsed_s <= 0:
+        return IOB_SCALE
+    step_s = IOB_STEP_MIN * 60
+    i = elapsed_s // step_s
+    if i >= len(iob_table) - 1:
+        return 0
+    rest = elapsed_s - i * step_s
+    return iob_table[i] - (iob_table[i] - iob_table[i + 1]) * rest // step_s
+
+def add_active_dose(username, timestamp, dose_mu):
+    """Ajoute une injection au modèle d'insuline active"""
+    if dose_mu > 0:
+        active_doses.setdefault(username, []).append((int(timestamp), dose_mu))
+
+def load_active_doses():
+    """Reprend les injections encore actives depuis l'historique (au démarrage)"""
+    active_doses.clear()
+    since = int(time.time()) - INSULIN_DIA_MIN * 60
+    for username in store.users_index:
+        for record in iter_injection_history(username, history_search(username, since)):
+            add_active_dose(username, record[H_TIMESTAMP], record[H_DOSE])
+
+def insulin_on_board(username):
+    """Insuline active (mU) et minutes avant qu'elle soit nulle, en O(doses actives)"""
+    doses = active_doses.get(username)
+    if not doses:
+        return 0, 0
+    now = int(time.time())
+    dia_s = INSULIN_DIA_MIN * 60
+    # Oublier les injections dont l'action est terminée
+    while doses and now - doses[0][0] >= dia_s:
+        doses.pop(0)
+    
+    iob = 0
+    for timestamp, dose_mu in doses:
+        iob += dose_mu * iob_fraction(now - timestamp) // IOB_SCALE
+    zero_min = (doses[-1][0] + dia_s - now + 59) // 60 if doses else 0
+    return iob, zero_min
+
+def build_status_table():
+    """Précalcule le statut de chaque valeur de glycémie"""
+    global status_table
+    status_table = bytearray(GLUCOSE_MAX - GLUCOSE_MIN + 1)
+    for i in range(len(status_table)):
+        glucose = GLUCOSE_MIN + i
+        if glucose < 70:
+            status_table[i] = 0
+        elif glucose <= 140:
+            status_table[i] = 1
+        elif glucose <= 200:
+            status_table[i] = 2
+        else:
+            status_table[i] = 3
+
+def glucose_index(glucose):
+    """Index d'une glycémie dans les tables compilées"""
+    return min(max(int(glucose), GLUCOSE_MIN), GLUCOSE_MAX) - GLUCOSE_MIN
+
+def default_profile():
+    """Profil de dosage par défaut: un seul segment pour toute la journée"""
+    return {"segments": [{"start_hour": 0, "target": TARGET_GLUCOSE,
+                          "isf": INSULIN_SENSITIVITY, "carb_ratio": CARB_RATIO}]}
+
+def compile_profile(profile):
+    """Compile un profil en tables: segment par heure, dose de correction (mU) par glycémie"""
+    segments = sorted(profile["segments"], key=lambda segment: segment["start_hour"])
+    hour_segment = bytearray(24)
+    corrections = []
+    carb_ratios = []
+    for index, segment in enumerate(segments):
+        for hour in range(segment["start_hour"], 24):
+            hour_segment[hour] = index
+        
+        table = array('H', [0] * (GLUCOSE_MAX - GLUCOSE_MIN + 1))
+        for i in range(len(table)):
+            glucose = GLUCOSE_MIN + i
+            if glucose > CORRECTION_THRESHOLD:
+                dose_mu = (glucose - segment["target"]) * 1000 // segment["isf"]
+                # int(): un profil enregistré avant la validation stricte peut contenir des flottants
+                table[i] = min(max(int(dose_mu), 0), 0xFFFF)
+        corrections.append(table)
+        carb_ratios.append(segment["carb_ratio"])
+    return hour_segment, corrections, carb_ratios
+
+def validate_profile(profile):
+    """Vérifie un profil reçu par l'API; retourne un message d'erreur ou None"""
+    try:
+        segments = profile["segments"]
+        if not segments or len(segments) > 24:
+            return "Entre 1 et 24 segments"
+        hours = [segment["start_hour"] for segment in segments]
+        if 0 not in hours or len(set(hours)) != len(hours):
+            return "Le premier segment doit commencer à 0h, heures uniques"
+        for segment in segments:
+            if not isinstance(segment["start_hour"], int) or not 0 <= segment["start_hour"] <= 23:
+                return "Heure de début invalide"
+            if not isinstance(segment["target"], int) or not isinstance(segment["isf"], int):
+                # Tables de correction en entiers (array 'H')
+                return "Cible et sensibilité en mg/dL entiers"
+            if not 70 <= segment["target"] <= 180:
+                return "Cible hors limites (70-180 mg/dL)"
+            if not 5 <= segment["isf"] <= 400 or not 1 <= segment["carb_ratio"] <= 150:
+                return "Sensibilité ou ratio glucidique hors limites"
+    except (KeyError, TypeError):
+        return "Profil invalide"
+    return None
+
+def get_compiled_profile(username):
+    """Tables compilées du patient (compilation à la première utilisation)"""
+    compiled = compiled_profiles.get(username)
+    if compiled is None:
+        user = find_user(username)
+        profile = user.get("dosing_profile") if user else None
+        compiled = compile_profile(profile or default_profile())
+        compiled_profiles[username] = compiled
+    return compiled
+
+def save_dosing_profile(username, profile):
+    """Enregistre un profil de dosage et le compile immédiatement"""
+    error = validate_profile(profile)
+    if error:
+        return False, error
+    dosing_profile = {"segments": profile["segments"]}
+    # Compilé avant d'être enregistré: un profil qui ne compile pas n'est jamais persisté
+    compiled = compile_profile(dosing_profile)
+    find_user(username)["dosing_profile"] = dosing_profile
+    compiled_profiles[username] = compiled
+    mark_users_dirty()
+    return True, "Profil enregistré"
+
+def current_segment(username):
+    """Segment horaire actif et tables du patient"""
+    hour_segment, corrections, carb_ratios = get_compiled_profile(username)
+    return hour_segment[time.localtime()[3]], corrections, carb_ratios
+
+def carb_bolus(username, carbs):
+    """Dose (mU) couvrant un repas, selon le ratio glucidique compilé du segment actif"""
+    segment, _, carb_ratios = current_segment(username)
+    return int(carbs * 1000 / carb_ratios[segment])
+
+def calculate_insulin_dose(glucose, iob=0.0, username=None):
+    """Calcule la dose d'insuline recommandée (correction moins l'insuline encore active)"""
+    if username is None:
+        table = get_compiled_profile(None)[1][0]
+    else:
+        segment, corrections, _ = current_segment(username)
+        table = corrections[segment]
+    dose_mu = table[glucose_index(glucose)]
+    if not dose_mu:
+        return 0.0, "Aucune insuline nécessaire"
+    
+    dose = dose_mu / 1000
+    if iob > 0 and dose - iob <= 0:
+        return 0.0, "Insuline encore active suffisante"
+    dose = round((dose - iob) * 2) / 2
+    
+    if dose > 10:
+        return 10.0, "⚠️ Dose élevée - Consulter un médecin"
+    elif dose > 5:
+        return dose, "Dose importante - Vérifier avant injection"
+    elif dose > 0:
+        return dose, "Dose de correction recommandée"
+    else:
+        return 0.0, "Aucune insuline nécessaire"
+
+def get_glucose_status(glucose):
+    """Détermine le statut de la glycémie (lecture dans la table précalculée)"""
+    return GLUCOSE_STATUSES[status_table[glucose_index(glucose)]]
@@ -0,0 +1,175 @@
+"""Encodeurs des réponses de l'API: JSON échappé correctement, ou CBOR compact (RFC 8949)
+
+Chaque encodeur écrit directement dans un bytearray réutilisé d'une réponse à l'autre:
+ni gabarit str.format, ni chaîne intermédiaire pour la réponse complète.
+"""
+import struct
+
+ENCODER_BUFFER_SIZE = 512  # Capacité initiale (agrandie au besoin, puis conservée)
+CBOR_TYPE = "application/cbor"
+
+# Caractères à échapper dans une chaîne JSON (les autres contrôles: \u00XX)
+JSON_ESCAPES = {0x22: b'\\"', 0x5C: b'\\\\', 0x0A: b'\\n', 0x0D: b'\\r', 0x09: b'\\t', 0x08: b'\\b', 0x0C: b'\\f'}
+
+# CBOR: types majeurs et valeurs simples
+CBOR_UINT, CBOR_NEGINT, CBOR_BYTES, CBOR_TEXT, CBOR_ARRAY, CBOR_MAP = 0, 1, 2, 3, 4, 5
+CBOR_FALSE, CBOR_TRUE, CBOR_NULL, CBOR_FLOAT32, CBOR_FLOAT64 = 0xF4, 0xF5, 0xF6, 0xFA, 0xFB
+
+class Encoder:
+    """Tampon de sortie commun: encode() le réécrit depuis le début à chaque appel"""
+
+    def __init__(self, size=ENCODER_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.length = 0
+
+    def encode(self, value):
+        """Encode une valeur; la vue retournée reste valable jusqu'au prochain appel"""
+        self.reset()
+        self.value(value)
+        return self.view()
+
+    def reset(self):
+        self.length = 0
+
+    def view(self):
+        return memoryview(self.buffer)[:self.length]
+
+    def reserve(self, n):
+        """Garantit la place de n octets de plus; retourne la nouvelle fin"""
+        end = self.length + n
+        if end > len(self.buffer):
+            # Nouveau tampon: les vues déjà transmises gardent l'ancien
+            grown = bytearray(max(end, 2 * len(self.buffer)))
+            grown[:self.length] = memoryview(self.buffer)[:self.length]
+            self.buffer = grown
+        return end
+
+    def write(self, data):
+        end = self.reserve(len(data))
+        self.buffer[self.length:end] = data
+        self.length = end
+
+    def byte(self, b):
+        end = self.reserve(1)
+        self.buffer[self.length] = b
+        self.length = end
+
+class JSONEncoder(Encoder):
+    """JSON: None, bool, int, float, str, list/tuple et dict (clés converties en texte)"""
+
+    def value(self, v):
+        if v is None:
+            self.write(b'null')
+        elif v is True:
+            self.write(b'true')
+        elif v is False:
+            self.write(b'false')
+        elif isinstance(v, int):
+            self.write(str(v).encode())
+        elif isinstance(v, float):
+            # NaN et infinis n'existent pas en JSON
+            self.write(repr(v).encode() if v - v == 0 else b'null')
+        elif isinstance(v, str):
+            self.string(v)
+        elif isinstance(v, (list, tuple)):
+            self.byte(0x5B)  # [
+            first = True
+            for item in v:
+                if not first:
+                    self.write(b', ')
+                first = False
+                self.value(item)
+            self.byte(0x5D)  # ]
+        elif isinstance(v, dict):
+            self.byte(0x7B)  # {
+            first = True
+            for key, item in v.items():
+                if not first:
+                    self.write(b', ')
+                first = False
+                self.string(key if isinstance(key, str) else str(key))
+                self.write(b': ')
+                self.value(item)
+            self.byte(0x7D)  # }
+        else:
+            raise TypeError("type non sérialisable")
+
+    def string(self, text):
+        """Chaîne UTF-8 entre guillemets; les portions sans échappement sont copiées d'un bloc"""
+        data = memoryview(text.encode())
+        self.byte(0x22)
+        start = 0
+        for i in range(len(data)):
+            c = data[i]
+            if c < 0x20 or c == 0x22 or c == 0x5C:
+                self.write(data[start:i])
+                self.write(JSON_ESCAPES.get(c) or '\\u{:04x}'.format(c).encode())
+                start = i + 1
+        self.write(data[start:])
+        self.byte(0x22)
+
+class CBOREncoder(Encoder):
+    """CBOR: mêmes types que JSONEncoder, plus bytes; flottants sur 4 octets s'ils y tiennent"""
+
+    def head(self, major, n):
+        """Type majeur et longueur (ou entier) sur 1, 2, 3, 5 ou 9 octets"""
+        end = self.reserve(9)
+        major <<= 5
+        if n < 24:
+            self.buffer[self.length] = major | n
+            end = self.length + 1
+        elif n < 0x100:
+            struct.pack_into('>BB', self.buffer, self.length, major | 24, n)
+            end = self.length + 2
+        elif n < 0x10000:
+            struct.pack_into('>BH', self.buffer, self.length, major | 25, n)
+            end = self.length + 3
+        elif n < 0x100000000:
+            struct.pack_into('>BI', self.buffer, self.length, major | 26, n)
+            end = self.length + 5
+        else:
+            struct.pack_into('>BQ', self.buffer, self.length, major | 27, n)
+        self.length = end
+
+    def value(self, v):
+        if v is None:
+            self.byte(CBOR_NULL)
+        elif v is True:
+            self.byte(CBOR_TRUE)
+        elif v is False:
+            self.byte(CBOR_FALSE)
+        elif isinstance(v, int):
+            if v >= 0:
+                self.head(CBOR_UINT, v)
+            else:
+                self.head(CBOR_NEGINT, -1 - v)
+        elif isinstance(v, float):
+            self.float(v)
+        elif isinstance(v, str):
+            data = v.encode()
+            self.head(CBOR_TEXT, len(data))
+            self.write(data)
+        elif isinstance(v, (bytes, bytearray)):
+            self.head(CBOR_BYTES, len(v))
+            self.write(v)
+        elif isinstance(v, (list, tuple)):
+            self.head(CBOR_ARRAY, len(v))
+            for item in v:
+                self.value(item)
+        elif isinstance(v, dict):
+            self.head(CBOR_MAP, len(v))
+            for key, item in v.items():
+                self.value(key)
+                self.value(item)
+        else:
+            raise TypeError("type non sérialisable")
+
+    def float(self, v):
+        """Simple précision si la valeur y est exacte (toujours le cas sur l'ESP32)"""
+        end = self.reserve(9)
+        struct.pack_into('>Bf', self.buffer, self.length, CBOR_FLOAT32, v)
+        if struct.unpack_from('>f', self.buffer, self.length + 1)[0] == v or v != v:
+            self.length += 5
+        else:
+            struct.pack_into('>Bd', self.buffer, self.length, CBOR_FLOAT64, v)
+            self.length = end
@@ -0,0 +1,190 @@
+"""Filtres de glycémie composables (MicroPython sur l'ESP32, CPython sur l'hôte)
+
+Chaque étage traite un échantillon à la fois avec update() en O(1).
+batch() refiltre une trace enregistrée, vectorisé avec NumPy si disponible.
+"""
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Sur l'ESP32: filtrage incrémental uniquement
+
+def _linear_recurrence(gains, values, y0):
+    """y[k] = (1 - g[k]) * y[k-1] + g[k] * x[k], vectorisé par blocs (NumPy)"""
+    out = np.empty(len(values))
+    # Blocs courts: le produit cumulé des (1 - g) ne doit pas sous-déborder
+    smallest = max(float(np.min(1.0 - gains)), 1e-300) if len(gains) else 1.0
+    block = 256 if smallest >= 0.5 else max(1, min(256, int(-300 / np.log10(smallest))))
+    y = y0
+    for start in range(0, len(values), block):
+        g = gains[start:start + block]
+        x = values[start:start + block]
+        decay = np.cumprod(1.0 - g)
+        if decay[-1] == 0.0:
+            # Gain unitaire: la sortie recopie l'entrée
+            for i in range(len(x)):
+                y = (1.0 - g[i]) * y + g[i] * x[i]
+                out[start + i] = y
+            continue
+        out[start:start + block] = decay * (y + np.cumsum(g * x / decay))
+        y = out[start + len(x) - 1]
+    return out
+
+class MedianFilter:
+    """Médiane glissante sur n échantillons (élimine les pics isolés)"""
+
+    def __init__(self, n=5):
+        self.n = n
+        self.ring = array('f', [0] * n)      # Échantillons dans l'ordre d'arrivée
+        self.ordered = array('f', [0] * n)   # Mêmes échantillons, triés
+        self.index = 0
+        self.count = 0
+
+    def fresh(self):
+        return MedianFilter(self.n)
+
+    def update(self, x):
+        ordered = self.ordered
+        count = self.count
+        if count == self.n:
+            # Retirer l'échantillon le plus ancien de la fenêtre triée
+            old = self.ring[self.index]
+            i = 0
+            while ordered[i] != old:
+                i += 1
+            while i < count - 1:
+                ordered[i] = ordered[i + 1]
+                i += 1
+            count -= 1
+
+        # Insertion triée (n est petit et fixe: coût constant)
+        i = count
+        while i > 0 and ordered[i - 1] > x:
+            ordered[i] = ordered[i - 1]
+            i -= 1
+        ordered[i] = x
+        count += 1
+
+        self.ring[self.index] = ordered[i]
+        self.index = (self.index + 1) % self.n
+        self.count = count
+        return (ordered[(count - 1) // 2] + ordered[count // 2]) / 2
+
+    def batch(self, values):
+        if np is None:
+            f = self.fresh()
+            return [f.update(x) for x in values]
+        values = np.asarray(values, dtype=np.float32).astype(float)
+        out = np.empty(len(values))
+        head = min(self.n - 1, len(values))
+        for i in range(head):
+            # Fenêtres incomplètes du début, comme en mode incrémental
+            out[i] = np.median(values[:i + 1])
+        if len(values) >= self.n:
+            windows = np.lib.stride_tricks.sliding_window_view(values, self.n)
+            out[self.n - 1:] = np.median(windows, axis=1)
+        return out
+
+class EMAFilter:
+    """Moyenne mobile exponentielle: y += alpha * (x - y)"""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.value = None
+
+    def fresh(self):
+        return EMAFilter(self.alpha)
+
+    def update(self, x):
+        if self.value is None:
+            self.value = x
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+    def batch(self, values):
+        if np is None:
+            f = self.fresh()
+            return [f.update(x) for x in values]
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return values
+        gains = np.full(len(values) - 1, float(self.alpha))
+        return np.concatenate(([values[0]], _linear_recurrence(gains, values[1:], values[0])))
+
+class KalmanFilter:
+    """Filtre de Kalman scalaire (marche aléatoire): q = bruit du processus, r = bruit de mesure"""
+
+    def __init__(self, q=0.5, r=25.0):
+        self.q = q
+        self.r = r
+        self.value = None
+        self.p = r
+
+    def fresh(self):
+        return KalmanFilter(self.q, self.r)
+
+    def update(self, z):
+        if self.value is None:
+            self.value = z
+            return z
+        self.p += self.q
+        k = self.p / (self.p + self.r)
+        self.value += k * (z - self.value)
+        self.p *= 1 - k
+        return self.value
+
+    def batch(self, values):
+        if np is None:
+            f = self.fresh()
+            return [f.update(x) for x in values]
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return values
+        # Le gain ne dépend pas des mesures: on le calcule jusqu'à convergence, puis constant
+        gains = np.empty(len(values) - 1)
+        p = self.r
+        k_prev = -1.0
+        for i in range(len(gains)):
+            p += self.q
+            k = p / (p + self.r)
+            p *= 1 - k
+            gains[i] = k
+            if abs(k - k_prev) < 1e-12:
+                gains[i:] = k
+                break
+            k_prev = k
+        return np.concatenate(([values[0]], _linear_recurrence(gains, values[1:], values[0])))
+
+class FilterPipeline:
+    """Enchaînement d'étages: la sortie de chacun alimente le suivant"""
+
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def fresh(self):
+        return FilterPipeline(*[stage.fresh() for stage in self.stages])
+
+    def update(self, x):
+        for stage in self.stages:
+            x = stage.update(x)
+        return x
+
+    def batch(self, values):
+        """Refiltre une trace complète sans toucher à l'état incrémental"""
+        for stage in self.stages:
+            values = stage.batch(values)
+        return values
+
+if __name__ == "__main__":
+    # Réglage sur l'hôte: python filters.py readings.json (réponse de /api/readings)
+    import json
+    import sys
+
+    with open(sys.argv[1]) as f:
+        readings = json.load(f)["readings"]
+    pipeline = FilterPipeline(MedianFilter(5), KalmanFilter())
+    filtered = pipeline.batch([value for _, value in readings])
+    for (timestamp, value), smooth in zip(readings, filtered):
+        print(f"{timestamp}\t{value}\t{smooth:.1f}")
@@ -0,0 +1,339 @@
+"""Délivrance: relais de la pompe, bolus, basal programmé et planificateur"""
+import heapq
+import time
+from machine import Pin, Timer
+
+import store
+from dosing import add_active_dose
+from sensor import read_glucose
+from store import H_DOSE, H_TIMESTAMP, log_injection, mark_users_dirty
+
+# Configuration matérielle
+led = Pin(2, Pin.OUT)
+
+# Relais pour contrôle de la pompe à insuline
+relay_pump = Pin(10, Pin.OUT)
+relay_pump.value(0)  # Pompe éteinte au démarrage
+
+# Variables pour l'injection d'insuline (doses en milli-unités entières)
+injection_in_progress = False
+injection_start_time = 0
+target_dose_mu = 0
+injected_dose_mu = 0
+injection_timer = None     # Timer du contrôleur de délivrance (bolus et basal)
+INJECTION_RATE_MU = 100  # Milli-unités par seconde (0,1 U/s)
+BOLUS_MAX_MU = 10000     # Bolus immédiat ou planifié: 10 U au plus
+
+# Contrôleur de délivrance piloté par Timer matériel (indépendant du trafic HTTP)
+INJECTION_TIMER_ID = 1
+# Période nominale: le callback (IRQ logicielle) peut être retardé par une écriture en flash
+# ou un appel C bloquant; la latence d'arrêt réelle est mesurée (voir overshoot_max_ms)
+INJECTION_TICK_MS = 20
+INJECTION_STATS_SIZE = 20   # Injections conservées pour l'instrumentation
+injection_username = None
+injection_start_ms = 0      # ticks_ms à la mise en marche du relais
+injection_stop_ms = 0       # ticks_ms à l'arrêt du relais
+injection_finished = False  # Arrêtée par le Timer, enregistrement à faire hors interruption
+injection_stats = []        # [{target, actual, on_ms, overshoot_ms, reason}, ...]
+overshoot_max_ms = 0        # Pire dépassement mesuré depuis le démarrage
+tick_gap_max_ms = 0         # Plus long intervalle mesuré entre deux ticks
+last_tick_ms = 0
+
+# Planificateur: basal programmé, basal temporaire et bolus planifiés (tas par échéance)
+EV_PROGRAM, EV_TEMP_START, EV_TEMP_END, EV_BOLUS = range(4)
+EVENT_NAMES = ("program", "temp_start", "temp_end", "bolus")
+BASAL_MAX_RATE_MU_H = 5000  # 5 U/h
+BASAL_PULSE_MU = 50         # Basal délivré par impulsions de 50 mU entre les bolus
+BASAL_PULSE_MS = BASAL_PULSE_MU * 1000 // INJECTION_RATE_MU
+BASAL_PULSE_ACC = BASAL_PULSE_MU * 3600000  # Impulsion exprimée en mU x ms / h
+delivery_queue = []         # Tas de (échéance en s, type, seq, valeur, donnée)
+delivery_seq = 0
+scheduler_busy = False      # Tas en cours de modification: le tick ne le touche pas
+basal_program = []          # [(minute de début, débit en mU/h), ...]
+program_rate_mu_h = 0
+temp_rate_mu_h = None       # Débit temporaire actif, ou None
+temp_end_s = 0
+temp_id = 0                 # seq de l'événement qui a activé le basal temporaire
+basal_acc = 0               # Basal dû, en mU x ms / h (entier)
+basal_pulse_ms = 0          # Temps de marche restant pour l'impulsion basale
+basal_running = False       # Relais en marche pour le basal pendant le dernier intervalle
+basal_delivered_mu = 0
+
+def set_relay(on):
+    """Commande le relais de la pompe et la LED témoin"""
+    if relay_pump.value() != on:
+        relay_pump.value(1 if on else 0)
+        led.value(1 if on else 0)
+
+def begin_bolus(dose_mu, username):
+    """Lance un bolus (mU); False si un bolus est déjà en cours"""
+    global injection_in_progress, injection_start_time, target_dose_mu, injected_dose_mu
+    global injection_username, injection_start_ms
+    
+    if injection_in_progress or injection_finished:
+        return False
+    
+    injection_start_time = time.time()
+    target_dose_mu = dose_mu
+    injected_dose_mu = 0
+    injection_username = username
+    injection_start_ms = time.ticks_ms()
+    injection_in_progress = True
+    set_relay(True)
+    return True
+
+def is_finite_number(value):
+    """Nombre JSON utilisable: ni booléen, ni NaN, ni infini"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    return value == value and value - value == 0
+
+def start_injection(dose, username):
+    """Démarre l'injection d'insuline (dose en unités)"""
+    if injection_in_progress or injection_finished:
+        return False, "Injection déjà en cours"
+    
+    if not is_finite_number(dose) or dose <= 0:
+        return False, "Dose invalide"
+    dose_mu = int(dose * 1000 + 0.5)
+    if dose_mu > BOLUS_MAX_MU:
+        return False, f"Dose supérieure au maximum de {BOLUS_MAX_MU / 1000} unités"
+    
+    # Le Timer du contrôleur mesure la dose et coupe le relais, même sans requête HTTP
+    begin_bolus(dose_mu, username)
+    
+    print(f"💉 INJECTION DÉMARRÉE - Patient: {username} - Dose: {target_dose_mu / 1000} unités")
+    return True, f"Injection de {target_dose_mu / 1000} unités démarrée"
+
+def delivered_dose_mu(elapsed_ms):
+    """Dose délivrée (mU) après elapsed_ms de marche du relais, en arithmétique entière"""
+    return elapsed_ms * INJECTION_RATE_MU // 1000
+
+def current_basal_rate():
+    """Débit basal actif (mU/h): temporaire s'il y en a un, sinon programmé"""
+    return program_rate_mu_h if temp_rate_mu_h is None else temp_rate_mu_h
+
+def schedule_event(due_s, kind, value, data=None):
+    """Ajoute un événement au tas du planificateur (O(log n))"""
+    global delivery_seq
+    delivery_seq += 1
+    heapq.heappush(delivery_queue, (due_s, kind, delivery_seq, value, data))
+    return delivery_seq
+
+def scheduler_tick(now_s):
+    """Applique les événements échus (O(log n) par événement)"""
+    global program_rate_mu_h, temp_rate_mu_h, temp_end_s, temp_id
+    while delivery_queue and delivery_queue[0][0] <= now_s:
+        due, kind, seq, value, data = heapq.heappop(delivery_queue)
+        if kind == EV_PROGRAM:
+            program_rate_mu_h = value
+            # Même segment le lendemain
+            schedule_event(due + 86400, EV_PROGRAM, value)
+        elif kind == EV_TEMP_START:
+            temp_rate_mu_h = value
+            temp_end_s = data
+            temp_id = seq
+            schedule_event(data, EV_TEMP_END, seq)
+        elif kind == EV_TEMP_END:
+            if value == temp_id:
+                temp_rate_mu_h = None
+        elif kind == EV_BOLUS:
+            if not begin_bolus(value, data):
+                # Bolus déjà en cours: nouvel essai dans une seconde
+                schedule_event(now_s + 1, EV_BOLUS, value, data)
+
+def delivery_tick(timer):
+    """Callback du Timer: dose du bolus, impulsions basales et commande du relais"""
+    global last_tick_ms, injection_in_progress, injected_dose_mu, injection_stop_ms, injection_finished
+    global basal_acc, basal_pulse_ms, basal_running, basal_delivered_mu, tick_gap_max_ms
+    
+    now = time.ticks_ms()
+    dt = time.ticks_diff(now, last_tick_ms)
+    last_tick_ms = now
+    if dt > tick_gap_max_ms:
+        tick_gap_max_ms = dt
+    
+    if delivery_queue and not scheduler_busy:
+        now_s = time.time()
+        if delivery_queue[0][0] <= now_s:
+            scheduler_tick(now_s)
+    
+    # Bolus: entiers courts uniquement, aucune allocation sur le tas à chaque tick
+    if injection_in_progress:
+        injected_dose_mu = delivered_dose_mu(time.ticks_diff(now, injection_start_ms))
+        if injected_dose_mu >= target_dose_mu:
+            injection_stop_ms = now
+            injection_in_progress = False
+            # Journal et fichiers: hors interruption, dans update_injection()
+            injection_finished = True
+    
+    # Basal: le dû s'accumule en continu et se délivre par impulsions entre les bolus
+    basal_acc += current_basal_rate() * dt
+    if basal_running:
+        basal_pulse_ms -= dt
+    if not injection_in_progress and basal_pulse_ms <= 0 and basal_acc >= BASAL_PULSE_ACC:
+        basal_acc -= BASAL_PULSE_ACC
+        # Un dépassement de l'impulsion précédente raccourcit la suivante
+        basal_pulse_ms += BASAL_PULSE_MS
+        basal_delivered_mu += BASAL_PULSE_MU
+    basal_running = not injection_in_progress and basal_pulse_ms > 0
+    
+    set_relay(injection_in_progress or basal_running)
+
+def start_delivery_controller():
+    """Démarre le Timer du contrôleur de délivrance"""
+    global injection_timer, last_tick_ms
+    last_tick_ms = time.ticks_ms()
+    injection_timer = Timer(INJECTION_TIMER_ID)
+    injection_timer.init(period=INJECTION_TICK_MS, mode=Timer.PERIODIC, callback=delivery_tick)
+    print(f"⏱️ Contrôleur de délivrance toutes les {INJECTION_TICK_MS} ms")
+
+def stop_delivery_controller():
+    """Arrête le contrôleur de délivrance et coupe la pompe"""
+    global injection_timer
+    if injection_timer:
+        injection_timer.deinit()
+        injection_timer = None
+    set_relay(False)
+
+def set_basal_program(program, save=True):
+    """Remplace le programme basal journalier [(minute de début, mU/h), ...]"""
+    global basal_program, program_rate_mu_h, scheduler_busy
+    program = sorted((int(start), int(rate)) for start, rate in program)
+    if not program or program[0][0] != 0:
+        return False, "Le programme doit commencer à 0h00"
+    for start, rate in program:
+        if not 0 <= start < 1440 or not 0 <= rate <= BASAL_MAX_RATE_MU_H:
+            return False, "Segment basal hors limites"
+    
+    now_s = int(time.time())
+    hour, minute, second = time.localtime(now_s)[3:6]
+    midnight = now_s - (hour * 3600 + minute * 60 + second)
+    now_min = hour * 60 + minute
+    
+    scheduler_busy = True
+    try:
+        delivery_queue[:] = [event for event in delivery_queue if event[1] != EV_PROGRAM]
+        heapq.heapify(delivery_queue)
+        for start, rate in program:
+            due = midnight + start * 60
+            if due <= now_s:
+                due += 86400
+            schedule_event(due, EV_PROGRAM, rate)
+            if start <= now_min:
+                program_rate_mu_h = rate
+    finally:
+        scheduler_busy = False
+    
+    basal_program = program
+    if save:
+        store.users_data["basal_program"] = program
+        mark_users_dirty()
+    return True, "Programme basal enregistré"
+
+def set_temp_basal(rate_mu_h, minutes):
+    """Programme un basal temporaire immédiat"""
+    global scheduler_busy
+    if not 0 <= rate_mu_h <= BASAL_MAX_RATE_MU_H or not 0 < minutes <= 1440:
+        return False, "Basal temporaire hors limites"
+    now_s = int(time.time())
+    scheduler_busy = True
+    try:
+        schedule_event(now_s, EV_TEMP_START, rate_mu_h, now_s + minutes * 60)
+    finally:
+        scheduler_busy = False
+    return True, "Basal temporaire programmé"
+
+def cancel_temp_basal():
+    """Annule le basal temporaire actif"""
+    global temp_rate_mu_h
+    temp_rate_mu_h = None
+    return True, "Basal temporaire annulé"
+
+def schedule_bolus(dose_mu, username, minutes):
+    """Planifie un bolus dans quelques minutes"""
+    global scheduler_busy
+    if not 0 < dose_mu <= BOLUS_MAX_MU or not 0 <= minutes <= 1440:
+        return False, "Bolus planifié hors limites"
+    scheduler_busy = True
+    try:
+        schedule_event(int(time.time()) + minutes * 60, EV_BOLUS, dose_mu, username)
+    finally:
+        scheduler_busy = False
+    return True, "Bolus planifié"
+
+def finish_injection(reason):
+    """Enregistre l'injection terminée et les mesures réel/cible (hors interruption)"""
+    global injection_finished, injected_dose_mu, overshoot_max_ms
+    
+    on_ms = time.ticks_diff(injection_stop_ms, injection_start_ms)
+    # Dose réellement délivrée: durée de marche du relais x débit
+    actual_mu = delivered_dose_mu(on_ms)
+    overshoot_ms = on_ms - target_dose_mu * 1000 // INJECTION_RATE_MU if reason == "target" else 0
+    injected_dose_mu = actual_mu
+    overshoot_max_ms = max(overshoot_max_ms, overshoot_ms)
+    
+    injection_stats.append({
+        "target": target_dose_mu / 1000,
+        "actual": actual_mu / 1000,
+        "on_ms": on_ms,
+        "overshoot_ms": overshoot_ms,
+        "reason": reason
+    })
+    if len(injection_stats) > INJECTION_STATS_SIZE:
+        injection_stats.pop(0)
+    
+    # Enregistrer l'injection
+    glucose = read_glucose()
+    record = log_injection(injection_username, glucose, actual_mu, on_ms)
+    if record:
+        add_active_dose(injection_username, record[H_TIMESTAMP], record[H_DOSE])
+    injection_finished = False
+    return actual_mu
+
+def stop_injection(username):
+    """Arrête l'injection d'insuline"""
+    global injection_in_progress, injection_stop_ms
+    
+    if injection_in_progress:
+        injection_in_progress = False
+        set_relay(basal_running)
+        injection_stop_ms = time.ticks_ms()
+        reason = "manual"
+    elif injection_finished:
+        # Dose cible atteinte juste avant la demande d'arrêt
+        reason = "target"
+    else:
+        return False, "Aucune injection en cours"
+    
+    final_dose = finish_injection(reason) / 1000
+    
+    print(f"🛑 INJECTION ARRÊTÉE - Patient: {injection_username} - Dose: {final_dose:.3f} unités")
+    return True, f"Injection arrêtée - {final_dose:.3f} unités injectées"
+
+def update_injection():
+    """Enregistre une injection que le Timer a terminée (appelée hors interruption)"""
+    if injection_finished:
+        final_dose = finish_injection("target") / 1000
+        stats = injection_stats[-1]
+        print(f"✅ INJECTION TERMINÉE - Patient: {injection_username} - Dose: {final_dose:.3f} unités "
+              f"(cible {stats['target']}, dépassement {stats['overshoot_ms']} ms)")
+
+def get_injection_status():
+    """Retourne le statut actuel de l'injection (conversion en unités à l'affichage seulement)"""
+    if injection_in_progress:
+        return {
+            'active': True,
+            'target_dose': target_dose_mu / 1000,
+            'injected_dose': injected_dose_mu / 1000,
+            'progress': injected_dose_mu * 1000 // target_dose_mu / 10,
+            'remaining': (target_dose_mu - injected_dose_mu) / 1000
+        }
+    else:
+        return {
+            'active': False,
+            'target_dose': 0,
+            'injected_dose': 0,
+            'progress': 0,
+            'remaining': 0
+        }
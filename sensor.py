@@ -0,0 +1,274 @@
+"""Capteur: échantillonnage ADC par Timer, filtrage, cache, historique et tendance de la glycémie"""
+import time
+from array import array
+from machine import Pin, ADC, Timer
+from filters import FilterPipeline, MedianFilter, KalmanFilter
+
+# Configuration matérielle
+potentiometre = ADC(Pin(34))  # GPIO 34 pour le potentiomètre
+potentiometre.atten(ADC.ATTN_11DB)  # Plage 0-3.3V
+potentiometre.width(ADC.WIDTH_12BIT)  # Résolution 12 bits (0-4095)
+
+# Variables globales
+current_glucose = 0
+
+# Échantillonnage continu de l'ADC par Timer matériel
+SAMPLER_TIMER_ID = 0
+SAMPLE_PERIOD_MS = 5   # Période entre deux échantillons
+SAMPLE_WINDOW = 10     # Nombre d'échantillons moyennés par lecture
+readings_buffer = array('H', [0] * SAMPLE_WINDOW)  # Anneau des derniers échantillons ADC
+readings_index = 0     # Prochaine case à écrire
+readings_count = 0     # Cases remplies (< SAMPLE_WINDOW au démarrage)
+readings_sum = 0       # Somme courante de l'anneau
+sampler_timer = None
+
+# Filtrage: chaque bloc de SAMPLE_WINDOW échantillons (moyenne en mg/dL) traverse le pipeline
+GLUCOSE_FILTER = FilterPipeline(MedianFilter(5), KalmanFilter(q=0.5, r=25.0))
+filtered_glucose = None  # Dernière sortie du pipeline (mg/dL)
+
+# Cache de la dernière lecture, partagé par le dashboard, les API et l'injection
+GLUCOSE_CACHE_TTL_MS = 1000
+glucose_cache_ms = 0     # ticks_ms de la lecture en cache
+glucose_cache_valid = False
+
+# Historique des glycémies (anneau de capacité fixe)
+READING_PERIOD_MS = 10000   # Une mesure enregistrée toutes les 10 s
+READINGS_CAPACITY = 720     # 2 heures d'historique
+GLUCOSE_WINDOW_MIN = 15     # Fenêtre des statistiques renvoyées par /api/glucose
+last_reading_ms = 0
+
+# Tendance: régression linéaire glissante sur les dernières mesures enregistrées
+TREND_WINDOW = 30          # 5 minutes de mesures
+TREND_MIN_POINTS = 6
+HYPO_ALERT_GLUCOSE = 70    # Alerte si la prédiction à 30 min passe sous ce seuil
+TREND_ARROWS = (           # (pente minimale en mg/dL/min, flèche)
+    (3, "⇈"), (2, "↑"), (1, "↗"), (-1, "→"), (-2, "↘"), (-3, "↓"))
+
+def adc_to_glucose(adc_value):
+    """Convertit une valeur ADC (0-4095) en glycémie (mg/dL)"""
+    return (adc_value / 4095) * 380 + 20
+
+def sample_adc(timer):
+    """Callback du Timer: ajoute un échantillon ADC à l'anneau, filtre chaque bloc complet"""
+    global readings_index, readings_count, readings_sum, filtered_glucose
+    adc_value = potentiometre.read()
+    readings_sum += adc_value - readings_buffer[readings_index]
+    readings_buffer[readings_index] = adc_value
+    readings_index += 1
+    if readings_count < SAMPLE_WINDOW:
+        readings_count += 1
+    if readings_index == SAMPLE_WINDOW:
+        readings_index = 0
+        # Un passage dans le pipeline tous les SAMPLE_WINDOW échantillons: O(1) par échantillon
+        filtered_glucose = GLUCOSE_FILTER.update(adc_to_glucose(readings_sum / readings_count))
+
+def start_sampler():
+    """Démarre l'échantillonnage périodique du capteur"""
+    global sampler_timer
+    sample_adc(None)
+    sampler_timer = Timer(SAMPLER_TIMER_ID)
+    sampler_timer.init(period=SAMPLE_PERIOD_MS, mode=Timer.PERIODIC, callback=sample_adc)
+    invalidate_glucose_cache()
+    print(f"📈 Échantillonnage du capteur toutes les {SAMPLE_PERIOD_MS} ms")
+
+def stop_sampler():
+    """Arrête l'échantillonnage périodique du capteur"""
+    global sampler_timer
+    if sampler_timer:
+        sampler_timer.deinit()
+        sampler_timer = None
+        invalidate_glucose_cache()
+
+class GlucoseHistory:
+    """Anneau de glycémies horodatées: ajout O(1), aucune allocation par mesure"""
+    
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.values = array('H', [0] * capacity)  # mg/dL
+        self.times = array('I', [0] * capacity)   # time.time() en secondes
+        self.head = 0    # Prochaine case à écrire
+        self.count = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def append(self, timestamp, glucose):
+        """Ajoute une mesure, en écrasant la plus ancienne si l'anneau est plein"""
+        self.values[self.head] = glucose
+        self.times[self.head] = timestamp
+        self.head += 1
+        if self.head == self.capacity:
+            self.head = 0
+        if self.count < self.capacity:
+            self.count += 1
+    
+    def latest(self):
+        """Dernière mesure (timestamp, glycémie), ou None"""
+        if not self.count:
+            return None
+        i = self.head - 1 if self.head else self.capacity - 1
+        return self.times[i], self.values[i]
+    
+    def since(self, seconds, now=None):
+        """Parcourt les mesures des dernières secondes, de la plus ancienne à la plus récente"""
+        start = (now or time.time()) - seconds
+        # Recherche à rebours: on ne visite que la fenêtre demandée
+        n = 0
+        i = self.head
+        while n < self.count:
+            i = i - 1 if i else self.capacity - 1
+            if self.times[i] < start:
+                break
+            n += 1
+        i = self.head - n
+        if i < 0:
+            i += self.capacity
+        for _ in range(n):
+            yield self.times[i], self.values[i]
+            i += 1
+            if i == self.capacity:
+                i = 0
+    
+    def window(self, minutes, now=None):
+        """Statistiques (nombre, min, max, moyenne) des dernières minutes, ou None"""
+        count = 0
+        total = 0
+        low = 0xFFFF
+        high = 0
+        for _, value in self.since(minutes * 60, now):
+            count += 1
+            total += value
+            if value < low:
+                low = value
+            if value > high:
+                high = value
+        if not count:
+            return None
+        return count, low, high, total // count
+
+readings_history = GlucoseHistory(READINGS_CAPACITY)
+
+class TrendEngine:
+    """Pente des moindres carrés sur une fenêtre glissante, mise à jour en O(1) par mesure"""
+    
+    def __init__(self, size):
+        self.size = size
+        self.values = array('H', [0] * size)
+        self.times = array('I', [0] * size)
+        self.head = 0
+        self.count = 0
+        # Sommes en entiers (exactes), temps relatifs à self.base
+        self.base = 0
+        self.st = 0
+        self.sy = 0
+        self.stt = 0
+        self.sty = 0
+    
+    def add(self, timestamp, glucose):
+        """Ajoute une mesure et retire la plus ancienne si la fenêtre est pleine"""
+        if not self.count:
+            self.base = timestamp
+        if self.count == self.size:
+            t = self.times[self.head] - self.base
+            y = self.values[self.head]
+            self.st -= t
+            self.sy -= y
+            self.stt -= t * t
+            self.sty -= t * y
+            self.count -= 1
+        
+        t = timestamp - self.base
+        self.st += t
+        self.sy += glucose
+        self.stt += t * t
+        self.sty += t * glucose
+        self.values[self.head] = glucose
+        self.times[self.head] = timestamp
+        self.head = (self.head + 1) % self.size
+        self.count += 1
+        
+        if t > 3600:
+            self._rebase(timestamp)
+    
+    def _rebase(self, base):
+        """Décale l'origine des temps pour garder des sommes petites (O(1))"""
+        d = base - self.base
+        n = self.count
+        self.stt += -2 * d * self.st + n * d * d
+        self.sty -= d * self.sy
+        self.st -= n * d
+        self.base = base
+    
+    def slope(self):
+        """Pente en mg/dL par minute, ou None si la fenêtre est trop courte"""
+        n = self.count
+        if n < TREND_MIN_POINTS:
+            return None
+        denominator = n * self.stt - self.st * self.st
+        if not denominator:
+            return None
+        return (n * self.sty - self.st * self.sy) * 60 / denominator
+    
+    def predict(self, minutes):
+        """Glycémie prévue minutes après la dernière mesure (droite ajustée), ou None"""
+        slope = self.slope()
+        if slope is None:
+            return None
+        last = self.times[self.head - 1] - self.base
+        mean_t = self.st / self.count
+        mean_y = self.sy / self.count
+        return mean_y + slope * ((last - mean_t) / 60 + minutes)
+    
+    def arrow(self):
+        """Flèche de tendance façon capteur CGM"""
+        slope = self.slope()
+        if slope is None:
+            return None
+        for threshold, arrow in TREND_ARROWS:
+            if slope >= threshold:
+                return arrow
+        return "⇊"
+
+trend_engine = TrendEngine(TREND_WINDOW)
+
+def record_reading():
+    """Enregistre périodiquement la glycémie dans readings_history"""
+    global last_reading_ms
+    now = time.ticks_ms()
+    if readings_history.count and time.ticks_diff(now, last_reading_ms) < READING_PERIOD_MS:
+        return
+    last_reading_ms = now
+    timestamp = int(time.time())
+    glucose = read_glucose()
+    readings_history.append(timestamp, glucose)
+    trend_engine.add(timestamp, glucose)
+
+def invalidate_glucose_cache():
+    """Force la prochaine lecture à repartir du capteur"""
+    global glucose_cache_valid
+    glucose_cache_valid = False
+
+def glucose_cache_age():
+    """Âge de la lecture en cache (ms)"""
+    return time.ticks_diff(time.ticks_ms(), glucose_cache_ms)
+
+def read_glucose():
+    """Retourne la dernière glycémie filtrée (en cache pendant GLUCOSE_CACHE_TTL_MS)"""
+    global current_glucose, glucose_cache_ms, glucose_cache_valid
+    
+    if glucose_cache_valid and glucose_cache_age() < GLUCOSE_CACHE_TTL_MS:
+        return current_glucose
+    
+    if filtered_glucose is not None:
+        glucose = filtered_glucose
+    elif readings_count:
+        # Premier bloc pas encore complet
+        glucose = adc_to_glucose(readings_sum / readings_count)
+    else:
+        # Échantillonnage pas encore démarré
+        glucose = adc_to_glucose(potentiometre.read())
+    
+    current_glucose = int(glucose + 0.5)
+    glucose_cache_ms = time.ticks_ms()
+    glucose_cache_valid = True
+    return current_glucose
@@ -0,0 +1,1025 @@
+"""Serveur web asynchrone: analyse des requêtes, table de routage, API JSON et pages statiques"""
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio  # Sur l'hôte (CPython)
+import binascii
+import hashlib
+import json
+import os
+import struct
+import time
+
+import injection
+from encoding import CBOR_TYPE, CBOREncoder, JSONEncoder
+from dosing import (CARBS_MAX_G, calculate_insulin_dose, carb_bolus, default_profile, get_glucose_status,
+                    insulin_on_board, save_dosing_profile)
+from injection import (BOLUS_MAX_MU, EVENT_NAMES, EV_TEMP_END, INJECTION_TICK_MS, cancel_temp_basal, current_basal_rate,
+                       delivery_queue, get_injection_status, injection_stats, is_finite_number, led,
+                       schedule_bolus, set_basal_program, set_temp_basal, start_injection,
+                       stop_delivery_controller, stop_injection, update_injection)
+from sensor import (GLUCOSE_WINDOW_MIN, HYPO_ALERT_GLUCOSE, glucose_cache_age, invalidate_glucose_cache,
+                    read_glucose, readings_history, record_reading, stop_sampler, trend_engine)
+from store import (H_DOSE, H_DURATION, H_GLUCOSE, H_TIMESTAMP, ROLLUP_PERIODS, R_COUNT, R_DOSE, R_DURATION,
+                   R_GLUCOSE_MAX, R_GLUCOSE_MIN, R_GLUCOSE_SUM, authenticate_user, find_user, flush,
+                   get_current_user, history_search, injection_count, is_authenticated,
+                   iter_injection_history, logout_user, persist_tick, register_user)
+
+# Serveur web (asynchrone)
+SERVER_MAX_WORKERS = 4     # Clients servis en parallèle (sockets lwIP limités)
+SERVER_BACKLOG = 4
+CLIENT_TIMEOUT_S = 5       # Un client silencieux libère sa place
+CLIENT_WRITE_TIMEOUT_S = 10 # Un client qui ne lit plus sa réponse libère sa place
+PERSIST_PERIOD_S = 0.5     # Période des écritures différées
+KEEPALIVE_IDLE_S = 5        # Fermeture d'une connexion persistante inactive
+KEEPALIVE_MAX_SOCKETS = 2   # Connexions persistantes simultanées (une par onglet)
+KEEPALIVE_MAX_REQUESTS = 1000
+REQUEST_LINE_MAX = 512
+REQUEST_HEADER_LINE_MAX = 1024  # Cookies et User-Agent compris
+REQUEST_READ_CHUNK = 256        # Lecture du socket par blocs: la limite est vérifiée à chaque bloc
+REQUEST_HEADERS_MAX = 32
+REQUEST_BODY_MAX = 4096
+STREAM_PERIOD_S = 0.5       # Période de diffusion SSE (ancienne période d'interrogation)
+STREAM_HEARTBEAT_MS = 15000 # Commentaire SSE si rien n'a changé depuis
+STREAM_MAX_CLIENTS = 4
+stream_subscribers = []     # EventStream des clients connectés à /api/stream
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x8, 0x9, 0xA
+WS_MAX_CLIENTS = 2
+WS_MAX_PAYLOAD = 1024       # Les commandes sont courtes
+WS_IDLE_PERIOD_S = 0.1      # Surveillance de la pompe hors injection
+ws_sessions = []            # WebSocketSession ouvertes
+HEADER_BUFFER_SIZE = 512    # Ligne de statut et en-têtes, tampon réutilisé par connexion
+RESPONSE_CHUNK_SIZE = 1024  # Taille des tranches de corps: borne la mémoire par requête
+active_workers = 0
+keepalive_open = 0
+server_stats = {"connections": 0, "requests": 0}
+boot_stats = {"boot_ms": 0, "mem_free_start": 0, "mem_free_imports": 0, "mem_free_ready": 0}
+worker_freed = None        # Event créé dans la boucle asyncio
+HISTORY_PAGE_SIZE = 50     # Enregistrements par page de /api/history (par défaut)
+HISTORY_PAGE_MAX = 500
+
+def parse_json_body(body):
+    """Parse le corps JSON de la requête"""
+    try:
+        return json.loads(body)
+    except:
+        return None
+
+def api_history(username, params):
+    """API historique: tableau JSON paginé, généré enregistrement par enregistrement"""
+    try:
+        cursor = int(params.get('cursor', 0))
+        limit = min(int(params.get('limit', HISTORY_PAGE_SIZE)), HISTORY_PAGE_MAX)
+        start_ts = params.get('from')
+        end_ts = params.get('to')
+        
+        # Bornes de la plage temporelle par recherche dichotomique (pas de parcours linéaire)
+        lo = history_search(username, int(start_ts)) if start_ts else 0
+        hi = history_search(username, int(end_ts) + 1) if end_ts else injection_count(username)
+    except ValueError:
+        yield '{"status": "error", "message": "Paramètres invalides"}'
+        return
+    
+    start = max(cursor, lo)
+    stop = max(start, min(start + max(limit, 0), hi))
+    next_cursor = stop if stop < hi else 'null'
+    
+    yield '{{"status": "success", "next_cursor": {}, "records": ['.format(next_cursor)
+    separator = ''
+    for record in iter_injection_history(username, start, stop):
+        yield '{}{{"timestamp": {}, "glucose": {}, "dose": {}, "duration": {}}}'.format(
+            separator, record[H_TIMESTAMP], record[H_GLUCOSE],
+            record[H_DOSE] / 1000, record[H_DURATION] / 1000)
+        separator = ', '
+    yield ']}'
+
+def api_result(success, message):
+    """Réponse usuelle des commandes: statut et message"""
+    return {"status": "success" if success else "error", "message": message}
+
+def api_stats(username, params):
+    """API agrégats: un objet par bucket horaire ou journalier, du plus récent au plus ancien"""
+    period = params.get('period', 'daily')
+    if period not in ROLLUP_PERIODS:
+        return api_result(False, "Période invalide")
+    try:
+        limit = int(params.get('limit', ROLLUP_PERIODS[period][1]))
+    except ValueError:
+        return api_result(False, "Paramètres invalides")
+    
+    buckets = find_user(username)["rollups"][period]
+    items = []
+    for key in sorted(buckets, key=int, reverse=True)[:limit]:
+        bucket = buckets[key]
+        items.append({
+            "start": int(key), "count": bucket[R_COUNT], "dose": bucket[R_DOSE] / 1000,
+            "glucose_min": bucket[R_GLUCOSE_MIN], "glucose_max": bucket[R_GLUCOSE_MAX],
+            "glucose_mean": round(bucket[R_GLUCOSE_SUM] / bucket[R_COUNT], 1),
+            "duration": bucket[R_DURATION] / 1000})
+    return {"status": "success", "period": period, "buckets": items}
+
+def api_basal(username, method, data):
+    """API basal: lecture de l'état du planificateur ou programme / temporaire / bolus planifié"""
+    if method == 'POST':
+        try:
+            if "program" in data:
+                success, message = set_basal_program(
+                    [(start, int(rate * 1000 + 0.5)) for start, rate in data["program"]])
+            elif "temp" in data:
+                success, message = set_temp_basal(
+                    int(data["temp"]["rate"] * 1000 + 0.5), int(data["temp"]["minutes"]))
+            elif data.get("cancel_temp"):
+                success, message = cancel_temp_basal()
+            elif "bolus" in data:
+                success, message = schedule_bolus(
+                    int(data["bolus"]["dose"] * 1000 + 0.5), username,
+                    int(data["bolus"].get("in_minutes", 0)))
+            else:
+                success, message = False, "Commande inconnue"
+        except (KeyError, TypeError, ValueError):
+            success, message = False, "Paramètres invalides"
+        return api_result(success, message)
+    
+    upcoming = []
+    for due, kind, seq, value, _ in sorted(delivery_queue)[:10]:
+        if kind == EV_TEMP_END:
+            value = 0
+        upcoming.append({"at": due, "type": EVENT_NAMES[kind], "value": value / 1000})
+    return {
+        "status": "success",
+        "rate": current_basal_rate() / 1000,
+        "source": "program" if injection.temp_rate_mu_h is None else "temp",
+        "temp_end": None if injection.temp_rate_mu_h is None else injection.temp_end_s,
+        "program": [(start, rate / 1000) for start, rate in injection.basal_program],
+        "delivered": injection.basal_delivered_mu / 1000,
+        "queue": upcoming,
+    }
+
+def api_glucose(session_id, params):
+    """API glucose avec vérification de session"""
+    if not is_authenticated(session_id):
+        return NOT_AUTHENTICATED
+    
+    if params.get('fresh') == '1':
+        invalidate_glucose_cache()
+    glucose = read_glucose()
+    state = glucose_fields(get_current_user(session_id), glucose)
+    state["glucose"] = glucose
+    state["age_ms"] = glucose_cache_age()
+    return state
+
+def glucose_fields(username, glucose):
+    """État du patient pour une glycémie donnée (nouveau dict), sans la mesure ni son âge"""
+    status, color, icon = get_glucose_status(glucose)
+    iob_mu, iob_zero_min = insulin_on_board(username)
+    insulin_dose, insulin_recommendation = calculate_insulin_dose(glucose, iob_mu / 1000, username)
+    injection_status = get_injection_status()
+    
+    window = readings_history.window(GLUCOSE_WINDOW_MIN)
+    if window:
+        count, low, high, mean = window
+        window = {"minutes": GLUCOSE_WINDOW_MIN, "count": count, "min": low, "max": high, "mean": mean}
+    
+    # Tendance entretenue à chaque mesure: ici, simple lecture des sommes courantes
+    slope = trend_engine.slope()
+    if slope is not None:
+        predicted_15 = trend_engine.predict(15)
+        predicted_30 = trend_engine.predict(30)
+        trend = {
+            "slope": round(slope, 2), "arrow": trend_engine.arrow(),
+            "predicted_15": int(predicted_15), "predicted_30": int(predicted_30),
+            "hypo_alert": predicted_30 < HYPO_ALERT_GLUCOSE}
+    else:
+        trend = None
+    
+    return {
+        "status": status, "color": color, "icon": icon,
+        "insulin_dose": insulin_dose, "insulin_recommendation": insulin_recommendation,
+        "iob": iob_mu / 1000, "iob_zero_min": iob_zero_min,
+        "window": window or None, "trend": trend,
+        "injection_status": injection_status,
+    }
+
+def api_readings(params):
+    """API mesures: glycémies des dernières minutes, générées une par une"""
+    try:
+        minutes = int(params.get('minutes', GLUCOSE_WINDOW_MIN))
+    except ValueError:
+        yield '{"status": "error", "message": "Paramètres invalides"}'
+        return
+    
+    yield '{"status": "success", "readings": ['
+    separator = ''
+    for timestamp, glucose in readings_history.since(minutes * 60):
+        yield '{}[{}, {}]'.format(separator, timestamp, glucose)
+        separator = ', '
+    yield ']}'
+
+JSON_HEADERS = 'Content-Type: application/json\r\n'
+CBOR_HEADERS = 'Content-Type: application/cbor\r\n'  # Réponses de l'API sur « Accept: application/cbor »
+HTML_HEADERS = 'Content-Type: text/html; charset=utf-8\r\n'
+REDIRECT_HEADERS = 'Location: /\r\n'
+# Pages: revalidées à chaque visite (ETag), le corps ne transite que s'il a changé
+STATIC_HEADERS = HTML_HEADERS + 'Cache-Control: no-cache\r\nVary: Accept-Encoding\r\n'
+STATIC_GZIP_HEADERS = STATIC_HEADERS + 'Content-Encoding: gzip\r\n'
+WWW_DIR = "www"            # Pages en flash, précompressées par build.py
+STATIC_PAGES = ("login", "dashboard")
+static_pages = {}  # {nom: (chemin, taille, etag, chemin gzip ou None, taille gzip, etag gzip)}
+STREAM_HEADERS = 'Content-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+NOT_AUTHENTICATED = {"status": "error", "message": "Non authentifié"}
+
+class Request:
+    """Requête HTTP analysée une seule fois: méthode, chemin, query, en-têtes, cookies, corps"""
+
+    def __init__(self, method, target, version):
+        self.method = method
+        self.version = version
+        self.path, _, query = target.partition('?')
+        self.query = parse_pairs(query, '&')
+        self.headers = {}
+        self.cookies = {}
+        self.body = ''
+        self.session_id = None
+
+    def json(self):
+        return parse_json_body(self.body)
+
+def parse_pairs(text, separator):
+    """Découpe « clé=valeur » séparés par separator (query string ou cookies)"""
+    params = {}
+    for pair in text.split(separator):
+        key, sep, value = pair.strip().partition('=')
+        if sep:
+            params[key] = value
+    return params
+
+def route_login(req):
+    """Ouvre une session"""
+    data = req.json()
+    if data:
+        success, session = authenticate_user(data['username'], data['password'])
+        if success:
+            response = {"status": "success", "session_id": session}
+        else:
+            response = api_result(False, "Identifiants incorrects")
+    else:
+        response = api_result(False, "Données invalides")
+    return '200 OK', JSON_HEADERS, response
+
+def route_register(req):
+    """Crée un compte patient"""
+    print("📥 Requête d'inscription reçue")
+    print(f"📄 Body brut: {req.body[:100]}")  # Afficher les 100 premiers caractères
+    
+    data = req.json()
+    print(f"📊 Data parsé: {data}")
+    
+    if data:
+        try:
+            success, message = register_user(
+                data['username'],
+                data['password'],
+                data['email'],
+                data['age'],
+                data['weight']
+            )
+            response = api_result(success, message)
+            if success:
+                print(f"✅ Inscription réussie")
+            else:
+                print(f"❌ Inscription échouée: {message}")
+        except Exception as e:
+            print(f"❌ Exception: {e}")
+            response = api_result(False, "Erreur serveur: {}".format(e))
+    else:
+        print("❌ Données JSON invalides")
+        response = api_result(False, "Données invalides")
+    return '200 OK', JSON_HEADERS, response
+
+def route_logout(req):
+    """Ferme la session"""
+    logout_user(req.session_id)
+    return '200 OK', JSON_HEADERS, {"status": "success"}
+
+def bolus_request(username, data):
+    """Dose totale d'une demande de bolus; retourne (total en mU, bolus repas en mU, erreur ou None)"""
+    dose = data.get('dose', 0)
+    carbs = data.get('carbs', 0)
+    if not is_finite_number(dose) or dose < 0:
+        return 0, 0, "Dose invalide"
+    if not is_finite_number(carbs) or not 0 <= carbs <= CARBS_MAX_G:
+        return 0, 0, "Glucides hors limites (0-{} g)".format(CARBS_MAX_G)
+    # Bolus repas: ratio glucidique compilé du segment horaire actif
+    carb_mu = carb_bolus(username, carbs) if carbs > 0 else 0
+    total_mu = int(dose * 1000 + 0.5) + carb_mu
+    if total_mu > BOLUS_MAX_MU:
+        return total_mu, carb_mu, "Dose totale de {} unités supérieure au maximum de {} unités".format(
+            total_mu / 1000, BOLUS_MAX_MU / 1000)
+    return total_mu, carb_mu, None
+
+def injection_start_command(username, data):
+    """Démarre un bolus (dose et glucides optionnels), depuis l'API ou le WebSocket"""
+    total_mu, _, error = bolus_request(username, data)
+    if error:
+        return False, error
+    return start_injection(total_mu / 1000, username)
+
+def route_injection_start(req):
+    """Démarre un bolus (dose et glucides optionnels), ou calcule sa dose si « preview »"""
+    data = req.json()
+    if data and data.get('preview'):
+        # Aperçu pour la confirmation du tableau de bord: dose calculée, rien n'est démarré
+        total_mu, carb_mu, error = bolus_request(get_current_user(req.session_id), data)
+        if error:
+            response = api_result(False, error)
+        else:
+            response = {"status": "success", "dose": total_mu / 1000, "carb_dose": carb_mu / 1000}
+    elif data:
+        success, message = injection_start_command(get_current_user(req.session_id), data)
+        response = api_result(success, message)
+    else:
+        response = api_result(False, "Données invalides")
+    return '200 OK', JSON_HEADERS, response
+
+def route_injection_stats(req):
+    """Instrumentation des injections (dose réelle vs cible, latences mesurées et non garanties)"""
+    response = {"status": "success", "tick_ms": INJECTION_TICK_MS,
+                "max_overshoot_ms": injection.overshoot_max_ms,
+                "max_tick_gap_ms": injection.tick_gap_max_ms, "injections": injection_stats}
+    return '200 OK', JSON_HEADERS, response
+
+def route_injection_stop(req):
+    """Arrête le bolus en cours"""
+    success, message = stop_injection(get_current_user(req.session_id))
+    return '200 OK', JSON_HEADERS, api_result(success, message)
+
+def route_history(req):
+    """Historique des injections, envoyé au fil de l'eau"""
+    return '200 OK', JSON_HEADERS, api_history(get_current_user(req.session_id), req.query)
+
+def route_readings(req):
+    """Mesures de glycémie, envoyées au fil de l'eau"""
+    return '200 OK', JSON_HEADERS, api_readings(req.query)
+
+def route_profile_get(req):
+    """Profil de dosage du patient"""
+    profile = find_user(get_current_user(req.session_id)).get("dosing_profile") or default_profile()
+    return '200 OK', JSON_HEADERS, {"status": "success", "profile": profile}
+
+def route_profile_post(req):
+    """Enregistre le profil de dosage"""
+    success, message = save_dosing_profile(get_current_user(req.session_id), req.json() or {})
+    return '200 OK', JSON_HEADERS, api_result(success, message)
+
+def route_basal(req):
+    """Programme basal, basal temporaire et bolus planifiés"""
+    data = req.json() if req.method == 'POST' else None
+    return '200 OK', JSON_HEADERS, api_basal(get_current_user(req.session_id), req.method, data or {})
+
+def route_stats(req):
+    """Agrégats horaires ou journaliers"""
+    return '200 OK', JSON_HEADERS, api_stats(get_current_user(req.session_id), req.query)
+
+def route_server(req):
+    """Instrumentation du serveur (réutilisation des connexions, démarrage et mémoire)"""
+    response = {"status": "success", "connections": server_stats["connections"],
+                "requests": server_stats["requests"], "keepalive_open": keepalive_open, "boot": boot_stats}
+    return '200 OK', JSON_HEADERS, response
+
+def route_stream(req):
+    """Flux SSE de l'état du patient (poussé à chaque changement)"""
+    if len(stream_subscribers) >= STREAM_MAX_CLIENTS:
+        # Le tableau de bord repasse en interrogation périodique
+        return '503 Service Unavailable', JSON_HEADERS, api_result(False, "Trop de flux ouverts")
+    return '200 OK', STREAM_HEADERS, EventStream(get_current_user(req.session_id))
+
+def route_websocket(req):
+    """Canal WebSocket de commande de la pompe (poignée de main RFC 6455)"""
+    key = req.headers.get('sec-websocket-key')
+    if req.headers.get('upgrade', '').lower() != 'websocket' or not key:
+        return '400 Bad Request', JSON_HEADERS, api_result(False, "WebSocket attendu")
+    if len(ws_sessions) >= WS_MAX_CLIENTS:
+        return '503 Service Unavailable', JSON_HEADERS, api_result(False, "Trop de canaux ouverts")
+    headers = 'Upgrade: websocket\r\nSec-WebSocket-Accept: {}\r\n'.format(websocket_accept(key))
+    return '101 Switching Protocols', headers, WebSocketSession(get_current_user(req.session_id))
+
+def route_glucose(req):
+    """Glycémie, tendance et recommandation"""
+    return '200 OK', JSON_HEADERS, api_glucose(req.session_id, req.query)
+
+def route_user(req):
+    """Informations du patient connecté (affichées par le tableau de bord)"""
+    user = find_user(get_current_user(req.session_id))
+    response = {"status": "success", "username": user["username"], "age": user.get("age", "N/A"),
+                "weight": user.get("weight", "N/A"), "email": user.get("email", "N/A")}
+    return '200 OK', JSON_HEADERS, response
+
+def build_static_pages():
+    """Indexe les pages de www/ (taille et ETag) sans les garder en mémoire"""
+    for name in STATIC_PAGES:
+        path = "{}/{}.html".format(WWW_DIR, name)
+        etag = '"{:08x}'.format(file_crc32(path))
+        gz_path = path + ".gz"
+        try:
+            gz_size = os.stat(gz_path)[6]
+        except OSError:
+            # Pas de version précompressée (étape de build non lancée)
+            gz_path, gz_size = None, 0
+        static_pages[name] = (path, os.stat(path)[6], etag + '"', gz_path, gz_size, etag + '-gz"')
+        print(f"📄 Page {name}: {static_pages[name][1]} o, gzip {gz_size} o")
+
+def file_crc32(path):
+    """CRC32 d'un fichier, calculé morceau par morceau"""
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(RESPONSE_CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = binascii.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+class FileBody:
+    """Corps de réponse lu depuis la flash, de longueur connue d'avance"""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+def serve_static(req, name):
+    """Page statique: gzip si accepté, 304 si la copie du navigateur est à jour"""
+    path, size, etag, gz_path, gz_size, etag_gz = static_pages[name]
+    if gz_path and 'gzip' in req.headers.get('accept-encoding', ''):
+        path, size, etag = gz_path, gz_size, etag_gz
+        headers = STATIC_GZIP_HEADERS
+    else:
+        headers = STATIC_HEADERS
+    headers += 'ETag: {}\r\n'.format(etag)
+    if req.headers.get('if-none-match') == etag:
+        return '304 Not Modified', headers, b''
+    # Page envoyée depuis la flash au fil de l'eau, longueur connue d'avance
+    return '200 OK', headers, FileBody(path, size)
+
+def route_dashboard(req):
+    """Tableau de bord (session obligatoire)"""
+    if is_authenticated(req.session_id):
+        return serve_static(req, "dashboard")
+    # Redirection vers login
+    return '302 Found', REDIRECT_HEADERS, ''
+
+def route_login_page(req):
+    """Page de connexion"""
+    return serve_static(req, "login")
+
+# Table de routage: (méthode, chemin) -> (fonction, session obligatoire)
+ROUTES = {
+    ('GET', '/'): (route_login_page, False),
+    ('POST', '/api/login'): (route_login, False),
+    ('POST', '/api/register'): (route_register, False),
+    ('POST', '/api/logout'): (route_logout, False),
+    ('POST', '/api/injection/start'): (route_injection_start, True),
+    ('GET', '/api/injection/stats'): (route_injection_stats, True),
+    ('POST', '/api/injection/stop'): (route_injection_stop, True),
+    ('GET', '/api/history'): (route_history, True),
+    ('GET', '/api/readings'): (route_readings, True),
+    ('GET', '/api/profile'): (route_profile_get, True),
+    ('POST', '/api/profile'): (route_profile_post, True),
+    ('GET', '/api/basal'): (route_basal, True),
+    ('POST', '/api/basal'): (route_basal, True),
+    ('GET', '/api/stats'): (route_stats, True),
+    ('GET', '/api/server'): (route_server, True),
+    ('GET', '/api/glucose'): (route_glucose, False),
+    ('GET', '/api/stream'): (route_stream, True),
+    ('GET', '/api/ws'): (route_websocket, True),
+    ('GET', '/api/user'): (route_user, True),
+    ('GET', '/dashboard'): (route_dashboard, False),
+}
+
+def handle_request(req):
+    """Route une requête: retourne (statut, en-têtes, corps dict, texte ou générateur de morceaux)"""
+    route = ROUTES.get((req.method, req.path))
+    if route is None:
+        if req.path.startswith('/api/'):
+            return '404 Not Found', JSON_HEADERS, api_result(False, "Route inconnue")
+        # Page de connexion (par défaut)
+        return route_login_page(req)
+    handler, needs_session = route
+    if needs_session and not is_authenticated(req.session_id):
+        return '200 OK', JSON_HEADERS, NOT_AUTHENTICATED
+    return handler(req)
+
+async def acquire_worker():
+    """Attend une place parmi les SERVER_MAX_WORKERS clients servis en parallèle"""
+    global active_workers
+    while active_workers >= SERVER_MAX_WORKERS:
+        worker_freed.clear()
+        await worker_freed.wait()
+    active_workers += 1
+
+def release_worker():
+    """Libère la place d'un client terminé"""
+    global active_workers
+    active_workers -= 1
+    worker_freed.set()
+
+class RequestReader:
+    """Lecture tamponnée d'une connexion, lignes bornées (readline de uasyncio n'a pas de limite)
+
+    Remplace le StreamReader pour toute la connexion (corps, SSE, WebSocket): les octets déjà
+    lus au-delà d'une ligne restent dans le tampon.
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.buffer = b''
+
+    async def readline(self, limit):
+        """Ligne terminée par \n (ou fin de flux); ValueError dès qu'elle dépasse limit octets"""
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                if end >= limit:
+                    raise ValueError("ligne trop longue")
+                line, self.buffer = self.buffer[:end + 1], self.buffer[end + 1:]
+                return line
+            if len(self.buffer) >= limit:
+                raise ValueError("ligne trop longue")
+            data = await self.reader.read(REQUEST_READ_CHUNK)
+            if not data:
+                line, self.buffer = self.buffer, b''
+                return line
+            self.buffer += data
+
+    async def read(self, n):
+        if self.buffer:
+            data, self.buffer = self.buffer[:n], self.buffer[n:]
+            return data
+        return await self.reader.read(n)
+
+    async def readexactly(self, n):
+        data, self.buffer = self.buffer[:n], self.buffer[n:]
+        if len(data) < n:
+            data += await self.reader.readexactly(n - len(data))
+        return data
+
+async def read_request(reader):
+    """Lit une requête au fil des paquets: ligne de requête, en-têtes, corps borné par Content-Length
+
+    Retourne None si le client a fermé la connexion, lève ValueError si la requête est invalide.
+    """
+    line = await reader.readline(REQUEST_LINE_MAX)
+    if not line:
+        return None
+    parts = line.decode('utf-8').split()
+    if len(parts) != 3:
+        raise ValueError("ligne de requête")
+    req = Request(parts[0], parts[1], parts[2])
+    
+    while True:
+        line = await reader.readline(REQUEST_HEADER_LINE_MAX)
+        if line in (b'\r\n', b'\n'):
+            break
+        if not line or len(req.headers) >= REQUEST_HEADERS_MAX:
+            raise ValueError("en-têtes")
+        name, sep, value = line.decode('utf-8').partition(':')
+        if sep:
+            req.headers[name.strip().lower()] = value.strip()
+    
+    length = int(req.headers.get('content-length', 0))
+    if not 0 <= length <= REQUEST_BODY_MAX:
+        raise ValueError("corps")
+    body = b''
+    while len(body) < length:
+        chunk = await reader.read(length - len(body))
+        if not chunk:
+            raise ValueError("corps incomplet")
+        body += chunk
+    req.body = body.decode('utf-8')
+    
+    if 'cookie' in req.headers:
+        req.cookies = parse_pairs(req.headers['cookie'], ';')
+    req.session_id = req.query.get('session') or req.cookies.get('session')
+    return req
+
+def wants_keepalive(req):
+    """HTTP/1.1: connexion persistante sauf « Connection: close »; HTTP/1.0: sur demande"""
+    connection = req.headers.get('connection', '').lower()
+    if connection == 'close':
+        return False
+    return req.version == 'HTTP/1.1' or connection == 'keep-alive'
+
+def wants_cbor(req):
+    """Encodage binaire des réponses de l'API si le client l'annonce dans Accept"""
+    return CBOR_TYPE in req.headers.get('accept', '')
+
+async def drain(stream):
+    """Attend l'envoi d'un message de flux; asyncio.TimeoutError si le client ne lit plus"""
+    await asyncio.wait_for(stream.drain(), CLIENT_WRITE_TIMEOUT_S)
+
+class EventStream:
+    """Abonnement SSE d'un client: reçoit les messages préparés par stream_task"""
+
+    def __init__(self, username):
+        self.username = username
+        self.ready = asyncio.Event()
+        self.pending = None   # Prochain message à envoyer (le plus récent remplace l'ancien)
+        self.glucose = None   # Dernier état envoyé, pour ne pousser que les changements
+        self.fields = None
+        self.closed = False
+        self.encoder = JSONEncoder()
+
+    def update(self, glucose, age_ms, fields):
+        """Prépare un message si l'état a changé; retourne True dans ce cas"""
+        if glucose == self.glucose and fields == self.fields:
+            return False
+        self.glucose = glucose
+        self.fields = fields
+        message = {"glucose": glucose, "age_ms": age_ms}
+        message.update(fields)  # fields est partagé entre les onglets d'un même patient
+        self.pending = message
+        self.ready.set()
+        return True
+
+    def heartbeat(self):
+        """Commentaire SSE: garde la connexion ouverte sans réveiller le tableau de bord"""
+        if self.pending is None:
+            self.pending = b': heartbeat\n\n'
+            self.ready.set()
+
+    async def watch(self, reader):
+        """Le client n'envoie plus rien: la fin de lecture signale sa déconnexion"""
+        try:
+            await reader.read(64)
+        except OSError:
+            pass
+        self.closed = True
+        self.ready.set()
+
+    async def run(self, stream, reader):
+        """Envoie l'état courant, puis chaque message jusqu'à la déconnexion du client"""
+        glucose = read_glucose()
+        self.update(glucose, glucose_cache_age(), glucose_fields(self.username, glucose))
+        stream_subscribers.append(self)
+        watcher = asyncio.create_task(self.watch(reader))
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                if self.closed:
+                    break
+                message, self.pending = self.pending, None
+                if isinstance(message, dict):
+                    encoder = self.encoder
+                    encoder.reset()
+                    encoder.write(b'data: ')
+                    encoder.value(message)
+                    encoder.write(b'\n\n')
+                    message = encoder.view()
+                stream.write(message)
+                await drain(stream)
+        finally:
+            stream_subscribers.remove(self)
+            watcher.cancel()
+
+async def stream_task():
+    """Diffuse une seule lecture du capteur à tous les abonnés SSE"""
+    last_beat = time.ticks_ms()
+    while True:
+        await asyncio.sleep(STREAM_PERIOD_S)
+        if not stream_subscribers:
+            continue
+        glucose = read_glucose()
+        age_ms = glucose_cache_age()
+        # État calculé une fois par patient, même s'il a plusieurs onglets ouverts
+        fields = {}
+        for sub in stream_subscribers:
+            if sub.username not in fields:
+                fields[sub.username] = glucose_fields(sub.username, glucose)
+            sub.update(glucose, age_ms, fields[sub.username])
+        if time.ticks_diff(time.ticks_ms(), last_beat) >= STREAM_HEARTBEAT_MS:
+            last_beat = time.ticks_ms()
+            for sub in stream_subscribers:
+                sub.heartbeat()
+
+def websocket_accept(key):
+    """Clé Sec-WebSocket-Accept: base64(sha1(clé + GUID))"""
+    digest = hashlib.sha1((key + WS_GUID).encode()).digest()
+    return binascii.b2a_base64(digest).strip().decode()
+
+def ws_send(stream, opcode, payload):
+    """Trame serveur (non masquée, non fragmentée): en-tête puis données, sans concaténation"""
+    n = len(payload)
+    if n < 126:
+        head = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        head = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    stream.write(head)
+    stream.write(payload)
+
+async def ws_read_frame(reader):
+    """Lit une trame client (masquée); retourne (opcode, données)"""
+    b0, b1 = await reader.readexactly(2)
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif n == 127:
+        n = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if not b1 & 0x80 or n > WS_MAX_PAYLOAD:
+        # Trame non masquée ou trop grande: fermeture du canal
+        raise ValueError("trame")
+    mask = await reader.readexactly(4)
+    payload = bytearray(await reader.readexactly(n))
+    for i in range(n):
+        payload[i] ^= mask[i & 3]
+    return b0 & 0x0F, payload
+
+class WebSocketSession:
+    """Canal de commande: start/stop reçus en JSON, progression poussée au rythme du contrôleur"""
+
+    def __init__(self, username):
+        self.username = username
+        self.encoder = JSONEncoder()
+        # Progression et réponses viennent de deux tâches: une seule écrit à la fois
+        # (uasyncio n'admet qu'une tâche en attente d'écriture par socket)
+        self.write_lock = asyncio.Lock()
+
+    async def send(self, stream, opcode, payload):
+        async with self.write_lock:
+            ws_send(stream, opcode, payload)
+            await drain(stream)
+
+    async def send_json(self, stream, message):
+        async with self.write_lock:
+            ws_send(stream, WS_TEXT, self.encoder.encode(message))
+            await drain(stream)
+
+    async def push_progress(self, stream):
+        """Progression de l'injection à chaque tick du contrôleur tant qu'elle change"""
+        last = None
+        while True:
+            status = get_injection_status()
+            status["type"] = "progress"
+            if status != last:
+                last = status
+                await self.send_json(stream, status)
+            await asyncio.sleep(INJECTION_TICK_MS / 1000 if status['active'] else WS_IDLE_PERIOD_S)
+
+    async def command(self, stream, payload):
+        """Exécute une commande {"cmd": "start", "dose", "carbs"} ou {"cmd": "stop"}"""
+        data = parse_json_body(payload.decode('utf-8'))
+        cmd = data.get('cmd') if isinstance(data, dict) else None
+        if cmd == 'start':
+            success, message = injection_start_command(self.username, data)
+        elif cmd == 'stop':
+            success, message = stop_injection(self.username)
+        else:
+            success, message = False, "Commande inconnue"
+        result = api_result(success, message)
+        result["type"] = "result"
+        result["cmd"] = cmd if isinstance(cmd, str) else None
+        await self.send_json(stream, result)
+
+    async def run(self, stream, reader):
+        """Traite les trames jusqu'à la fermeture du canal"""
+        ws_sessions.append(self)
+        pusher = asyncio.create_task(self.push_progress(stream))
+        try:
+            while True:
+                opcode, payload = await ws_read_frame(reader)
+                if opcode == WS_TEXT:
+                    await self.command(stream, payload)
+                elif opcode == WS_PING:
+                    await self.send(stream, WS_PONG, payload)
+                elif opcode == WS_CLOSE:
+                    await self.send(stream, WS_CLOSE, payload[:2])
+                    break
+        except (ValueError, EOFError):
+            # Trame invalide ou connexion coupée en cours de trame
+            pass
+        finally:
+            ws_sessions.remove(self)
+            pusher.cancel()
+
+class ResponseWriter:
+    """Écrit les réponses d'une connexion avec des tampons alloués une seule fois
+
+    Statut et en-têtes sont assemblés dans un bytearray réutilisé, les corps dict sont
+    encodés (JSON ou CBOR) dans le tampon de l'encodeur de la connexion; les corps partent
+    par tranches de RESPONSE_CHUNK_SIZE octets (vues memoryview, sans copie intermédiaire).
+    """
+
+    def __init__(self, stream, reader):
+        self.stream = stream
+        self.reader = reader
+        self.head = bytearray(HEADER_BUFFER_SIZE)
+        self.head_view = memoryview(self.head)
+        self.head_length = 0
+        self.chunk = bytearray(RESPONSE_CHUNK_SIZE)
+        self.chunk_view = memoryview(self.chunk)
+        self.json = JSONEncoder()
+        self.cbor = None  # Créé au premier client binaire
+
+    def put(self, data):
+        """Ajoute du texte ou des octets au tampon d'en-têtes"""
+        if isinstance(data, str):
+            data = data.encode()
+        n = len(data)
+        if self.head_length + n > HEADER_BUFFER_SIZE:
+            self.flush_head()
+            if n > HEADER_BUFFER_SIZE:
+                self.stream.write(data)
+                return
+        self.head_view[self.head_length:self.head_length + n] = data
+        self.head_length += n
+
+    def flush_head(self):
+        """Transmet le tampon d'en-têtes (le flux en garde une copie) et le vide"""
+        if self.head_length:
+            self.stream.write(self.head_view[:self.head_length])
+            self.head_length = 0
+
+    async def write_view(self, view):
+        """Envoie un bloc par tranches de taille fixe"""
+        for start in range(0, len(view), RESPONSE_CHUNK_SIZE):
+            self.stream.write(view[start:start + RESPONSE_CHUNK_SIZE])
+            await self.stream.drain()
+
+    async def send(self, status, headers, body, keep, chunked_ok, binary=False):
+        """Envoie une réponse; retourne False si la connexion doit être fermée ensuite
+
+        dict, str/bytes et FileBody partent avec Content-Length; un générateur part en
+        Transfer-Encoding: chunked si le client le comprend, sinon jusqu'à la fermeture.
+        """
+        if isinstance(body, dict):
+            if binary:
+                if self.cbor is None:
+                    self.cbor = CBOREncoder()
+                body = self.cbor.encode(body)
+                if headers is JSON_HEADERS:
+                    headers = CBOR_HEADERS
+            else:
+                body = self.json.encode(body)
+        elif isinstance(body, str):
+            body = body.encode()
+        self.put('HTTP/1.1 ')
+        self.put(status)
+        self.put('\r\n')
+        self.put(headers)
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            # 304: pas de corps, ni de longueur qui contredirait celle de la page
+            if status[:3] != '304':
+                self.put('Content-Length: {}\r\n'.format(len(body)))
+        elif isinstance(body, FileBody):
+            self.put('Content-Length: {}\r\n'.format(body.size))
+        elif isinstance(body, EventStream):
+            # Flux sans fin: délimité par la fermeture de la connexion
+            keep = False
+        elif isinstance(body, WebSocketSession):
+            keep = None
+        elif chunked_ok:
+            self.put('Transfer-Encoding: chunked\r\n')
+        else:
+            keep = False
+        if keep is None:
+            # Changement de protocole: la connexion appartient désormais au WebSocket
+            self.put('Connection: Upgrade\r\n\r\n')
+        else:
+            self.put('Connection: keep-alive\r\n\r\n' if keep else 'Connection: close\r\n\r\n')
+        
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            self.flush_head()
+            await self.write_view(memoryview(body))
+        elif isinstance(body, FileBody):
+            self.flush_head()
+            with open(body.path, 'rb') as f:
+                while True:
+                    n = f.readinto(self.chunk)
+                    if not n:
+                        break
+                    self.stream.write(self.chunk_view[:n])
+                    await self.stream.drain()
+        elif isinstance(body, (EventStream, WebSocketSession)):
+            self.flush_head()
+            await body.run(self.stream, self.reader)
+        else:
+            for part in body:
+                if isinstance(part, str):
+                    part = part.encode()
+                if not part:
+                    continue
+                if chunked_ok:
+                    self.put('{:x}\r\n'.format(len(part)))
+                    self.flush_head()
+                    await self.write_view(memoryview(part))
+                    self.put('\r\n')
+                else:
+                    self.flush_head()
+                    await self.write_view(memoryview(part))
+            if chunked_ok:
+                self.put('0\r\n\r\n')
+            self.flush_head()
+        await self.stream.drain()
+        return keep
+
+async def handle_client(reader, writer):
+    """Sert un client, éventuellement plusieurs requêtes sur la même connexion"""
+    global keepalive_open
+    server_stats["connections"] += 1
+    persistent = False
+    timeout = CLIENT_TIMEOUT_S
+    reader = RequestReader(reader)
+    out = ResponseWriter(writer, reader)
+    try:
+        for _ in range(KEEPALIVE_MAX_REQUESTS):
+            # Connexion inactive: aucune place de worker n'est retenue pendant l'attente
+            try:
+                req = await asyncio.wait_for(read_request(reader), timeout)
+            except ValueError:
+                await out.send('400 Bad Request', '', b'', False, False)
+                break
+            if req is None:
+                break
+            await acquire_worker()
+            try:
+                server_stats["requests"] += 1
+                status, headers, body = handle_request(req)
+                streaming = isinstance(body, (EventStream, WebSocketSession))
+                keep = wants_keepalive(req) and not streaming
+                if keep and not persistent:
+                    # Plafond des sockets persistantes: au-delà, fermeture après la réponse
+                    keep = keepalive_open < KEEPALIVE_MAX_SOCKETS
+                    if keep:
+                        persistent = True
+                        keepalive_open += 1
+                if not streaming:
+                    # Écriture bornée: un client qui ne lit plus ne garde pas sa place de worker
+                    keep = await asyncio.wait_for(
+                        out.send(status, headers, body, keep, req.version == 'HTTP/1.1', wants_cbor(req)),
+                        CLIENT_WRITE_TIMEOUT_S)
+            finally:
+                release_worker()
+            if streaming:
+                # Flux SSE ou WebSocket de longue durée: ne retient pas de place de worker
+                await out.send(status, headers, body, False, False)
+                break
+            if not keep:
+                break
+            timeout = KEEPALIVE_IDLE_S
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        if persistent:
+            keepalive_open -= 1
+        writer.close()
+        await writer.wait_closed()
+
+async def injection_task():
+    """Enregistre les injections terminées par le Timer (hors interruption)"""
+    while True:
+        update_injection()
+        await asyncio.sleep(INJECTION_TICK_MS / 1000)
+
+async def sensor_task():
+    """Historique des mesures (l'échantillonnage ADC reste sur son Timer matériel)"""
+    while True:
+        record_reading()
+        await asyncio.sleep(1)
+
+async def persist_task():
+    """Écritures différées de la base et compaction du journal"""
+    while True:
+        persist_tick()
+        await asyncio.sleep(PERSIST_PERIOD_S)
+
+async def serve(wlan):
+    """Serveur asynchrone et tâches de fond"""
+    global worker_freed
+    worker_freed = asyncio.Event()
+    await asyncio.start_server(handle_client, '0.0.0.0', 80, backlog=SERVER_BACKLOG)
+    
+    ip = wlan.ifconfig()[0]
+    print(f"\n{'='*50}")
+    print(f"🩸 GLUCOMÈTRE ESP32 - SERVEUR ACTIF")
+    print(f"💉 Système de Pompe à Insuline Sécurisé")
+    print(f"{'='*50}")
+    print(f"📱 URL d'accès:")
+    print(f"   👉 http://{ip}")
+    print(f"{'='*50}\n")
+    print("✅ En attente de connexions...\n")
+    
+    await asyncio.gather(injection_task(), sensor_task(), persist_task(), stream_task())
+
+def start_server(wlan):
+    """Démarre le serveur web avec authentification"""
+    try:
+        asyncio.run(serve(wlan))
+    except KeyboardInterrupt:
+        print("\n\n👋 Arrêt du serveur")
+        stop_injection("system")
+        stop_delivery_controller()
+        flush()
+        stop_sampler()
+        led.off()
@@ -0,0 +1,484 @@
+"""Stockage: base utilisateurs en mémoire, journal des injections, historique binaire et agrégats"""
+import json
+import os
+import struct
+import time
+
+# Fichier de stockage des utilisateurs
+USERS_FILE = "users.json"
+USERS_TMP_FILE = USERS_FILE + ".tmp"  # Écriture atomique: fichier temporaire puis renommage
+SAVE_COALESCE_MS = 2000  # Regroupe les modifications survenues dans cette fenêtre
+users_dirty = False      # Modifications en mémoire pas encore écrites
+users_dirty_since = 0
+
+# Base utilisateurs en mémoire (chargée une seule fois au démarrage)
+users_data = {"users": []}
+users_index = {}  # {username: user}
+
+# Journal des injections (append-only, une ligne JSON par injection)
+JOURNAL_FILE = "injections.log"
+JOURNAL_COMPACT_THRESHOLD = 20  # Compactage dans l'historique binaire après N injections
+journal_seq = 0       # Numéro de séquence de la dernière injection journalisée
+journal_tail = {}     # {username: [enregistrement, ...]} journalisés mais pas encore compactés
+journal_pending = 0   # Nombre total d'enregistrements dans journal_tail
+
+# Historique binaire des injections (un fichier par patient)
+# En-tête: magic, version, taille d'un enregistrement
+# Enregistrement: timestamp (s), glycémie (mg/dL), dose (milli-unités), durée (ms), seq du journal
+HISTORY_DIR = "history"
+HISTORY_MAGIC = b"PIH1"
+HISTORY_VERSION = 1
+HISTORY_HEADER_FMT = "<4sHH"
+HISTORY_HEADER_SIZE = struct.calcsize(HISTORY_HEADER_FMT)
+HISTORY_RECORD_FMT = "<IHIII"
+HISTORY_RECORD_SIZE = struct.calcsize(HISTORY_RECORD_FMT)
+H_TIMESTAMP, H_GLUCOSE, H_DOSE, H_DURATION, H_SEQ = range(5)
+
+# Agrégats horaires/journaliers par patient, stockés dans le profil
+# Bucket: [nombre, dose totale (mU), glycémie min, glycémie max, somme des glycémies, durée totale (ms)]
+ROLLUP_PERIODS = {"hourly": (3600, 48), "daily": (86400, 90)}  # {nom: (durée en s, buckets conservés)}
+R_COUNT, R_DOSE, R_GLUCOSE_MIN, R_GLUCOSE_MAX, R_GLUCOSE_SUM, R_DURATION = range(6)
+
+# Session active
+active_sessions = {}  # {session_id: username}
+
+def load_users():
+    """Charge les utilisateurs depuis le fichier JSON et construit l'index (au démarrage)"""
+    global users_data, users_index, journal_seq
+    try:
+        with open(USERS_FILE, 'r') as f:
+            users_data = json.load(f)
+    except:
+        try:
+            # Coupure entre la suppression et le renommage: le fichier temporaire est complet
+            with open(USERS_TMP_FILE, 'r') as f:
+                users_data = json.load(f)
+            print("♻️ Base restaurée depuis le fichier temporaire")
+        except:
+            # Si le fichier n'existe pas, créer une structure vide
+            users_data = {"users": []}
+    
+    try:
+        os.mkdir(HISTORY_DIR)
+    except OSError:
+        pass
+    
+    users_index = {}
+    for user in users_data["users"]:
+        users_index[user["username"]] = user
+    
+    # Ancien format: historique JSON dans chaque profil
+    if any("injection_history" in user for user in users_data["users"]):
+        convert_users_json()
+    
+    # Reprendre la numérotation après la dernière injection compactée
+    journal_seq = 0
+    for username in users_index:
+        last = history_read(username, history_count(username) - 1)
+        if last and last[H_SEQ] > journal_seq:
+            journal_seq = last[H_SEQ]
+        if "rollups" not in users_index[username]:
+            rebuild_rollups(users_index[username])
+    replay_journal()
+    
+    print(f"👥 {len(users_index)} utilisateur(s) chargé(s)")
+    return users_data
+
+def save_users():
+    """Sauvegarde la base en mémoire dans le fichier JSON (écriture atomique)"""
+    global users_dirty
+    try:
+        with open(USERS_TMP_FILE, 'w') as f:
+            json.dump(users_data, f)
+        try:
+            os.rename(USERS_TMP_FILE, USERS_FILE)
+        except OSError:
+            # Système de fichiers qui refuse d'écraser la destination (FAT)
+            os.remove(USERS_FILE)
+            os.rename(USERS_TMP_FILE, USERS_FILE)
+    except:
+        return False
+    users_dirty = False
+    return True
+
+def mark_users_dirty():
+    """Signale une modification de la base; l'écriture est différée et regroupée"""
+    global users_dirty, users_dirty_since
+    if not users_dirty:
+        users_dirty = True
+        users_dirty_since = time.ticks_ms()
+
+def persist_tick():
+    """Écritures différées, appelées hors du traitement des requêtes"""
+    if users_dirty and time.ticks_diff(time.ticks_ms(), users_dirty_since) >= SAVE_COALESCE_MS:
+        if not save_users():
+            print("❌ Erreur sauvegarde différée des utilisateurs")
+    compact_journal()
+
+def flush():
+    """Force toutes les écritures en attente (arrêt du serveur)"""
+    if users_dirty and not save_users():
+        print("❌ Erreur sauvegarde des utilisateurs")
+    compact_journal(force=True)
+
+def convert_users_json():
+    """Convertit l'ancien format (injection_history dans users.json) en fichiers binaires"""
+    for user in users_data["users"]:
+        history = user.pop("injection_history", None)
+        if history:
+            records = []
+            for entry in history:
+                records.append(make_history_record(
+                    entry["timestamp"], entry["glucose"], entry["dose"],
+                    entry["duration"], 0))
+            history_append(user["username"], records)
+            print(f"🔁 {len(records)} injection(s) convertie(s) pour {user['username']}")
+    save_users()
+
+def rebuild_rollups(user):
+    """Recalcule les agrégats d'un patient depuis son historique binaire (migration)"""
+    user["rollups"] = {"seq": 0}
+    for name in ROLLUP_PERIODS:
+        user["rollups"][name] = {}
+    for record in history_iter(user["username"]):
+        update_rollups(user, record)
+    mark_users_dirty()
+
+def update_rollups(user, record):
+    """Ajoute une injection aux agrégats horaires et journaliers (coût constant)"""
+    rollups = user["rollups"]
+    timestamp = record[H_TIMESTAMP]
+    glucose = record[H_GLUCOSE]
+    for name, (period, keep) in ROLLUP_PERIODS.items():
+        buckets = rollups[name]
+        key = str(timestamp - timestamp % period)
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [1, record[H_DOSE], glucose, glucose, glucose, record[H_DURATION]]
+            if len(buckets) > keep:
+                # Nouveau bucket seulement: l'élagage reste rare
+                del buckets[min(buckets, key=int)]
+        else:
+            bucket[R_COUNT] += 1
+            bucket[R_DOSE] += record[H_DOSE]
+            bucket[R_GLUCOSE_MIN] = min(bucket[R_GLUCOSE_MIN], glucose)
+            bucket[R_GLUCOSE_MAX] = max(bucket[R_GLUCOSE_MAX], glucose)
+            bucket[R_GLUCOSE_SUM] += glucose
+            bucket[R_DURATION] += record[H_DURATION]
+    rollups["seq"] = max(rollups["seq"], record[H_SEQ])
+
+def make_history_record(timestamp, glucose, dose, duration, seq):
+    """Construit un enregistrement d'historique depuis l'ancien format (unités, secondes)"""
+    return (int(timestamp), int(glucose), int(round(dose * 1000)),
+            int(round(duration * 1000)), seq)
+
+def history_path(username):
+    """Chemin du fichier d'historique binaire d'un patient"""
+    name = ""
+    for c in username:
+        if c.isalpha() or c.isdigit() or c in "-_":
+            name += c
+        else:
+            name += "%{:02x}".format(ord(c))
+    return HISTORY_DIR + "/" + name + ".bin"
+
+def history_count(username):
+    """Nombre d'enregistrements du fichier binaire (sans le lire)"""
+    try:
+        size = os.stat(history_path(username))[6]
+    except OSError:
+        return 0
+    # Un enregistrement tronqué (coupure pendant l'écriture) n'est pas compté
+    return max(0, (size - HISTORY_HEADER_SIZE) // HISTORY_RECORD_SIZE)
+
+def history_append(username, records):
+    """Ajoute des enregistrements à la fin du fichier binaire du patient
+
+    Les enregistrements déjà présents (seq inférieur ou égal au dernier du fichier) sont ignorés:
+    un compactage repris après une erreur d'écriture ne crée pas de doublons.
+    """
+    count = history_count(username)
+    last = history_read(username, count - 1)
+    # Encodés avant toute écriture: un enregistrement hors format n'en laisse pas d'autres à moitié écrits
+    packed = []
+    for record in records:
+        if last and record[H_SEQ] <= last[H_SEQ]:
+            continue
+        try:
+            packed.append(struct.pack(HISTORY_RECORD_FMT, *record))
+        except Exception as e:  # struct.error sur l'hôte, ValueError/OverflowError selon le port
+            print(f"❌ Injection ignorée dans l'historique binaire {record}: {e}")
+    
+    path = history_path(username)
+    try:
+        f = open(path, 'r+b')
+    except OSError:
+        f = open(path, 'w+b')
+        f.write(struct.pack(HISTORY_HEADER_FMT, HISTORY_MAGIC, HISTORY_VERSION, HISTORY_RECORD_SIZE))
+    
+    with f:
+        # Écrase un éventuel enregistrement tronqué en fin de fichier
+        f.seek(HISTORY_HEADER_SIZE + count * HISTORY_RECORD_SIZE)
+        for data in packed:
+            f.write(data)
+    return count + len(packed)
+
+def history_read(username, index):
+    """Lit l'enregistrement numéro index (accès direct), ou None"""
+    if index < 0:
+        return None
+    for record in history_iter(username, index, index + 1):
+        return record
+    return None
+
+def history_last(username, k):
+    """Retourne les k derniers enregistrements du fichier binaire"""
+    return list(history_iter(username, max(0, history_count(username) - k)))
+
+def history_iter(username, start=0, stop=None):
+    """Parcourt les enregistrements [start, stop) un par un, sans tout charger en mémoire"""
+    count = history_count(username)
+    if stop is None or stop > count:
+        stop = count
+    if start >= stop:
+        return
+    
+    buf = bytearray(HISTORY_RECORD_SIZE)
+    with open(history_path(username), 'rb') as f:
+        header = f.read(HISTORY_HEADER_SIZE)
+        if struct.unpack(HISTORY_HEADER_FMT, header) != (HISTORY_MAGIC, HISTORY_VERSION, HISTORY_RECORD_SIZE):
+            print(f"❌ Historique illisible: {username}")
+            return
+        f.seek(HISTORY_HEADER_SIZE + start * HISTORY_RECORD_SIZE)
+        for _ in range(stop - start):
+            if f.readinto(buf) != HISTORY_RECORD_SIZE:
+                return
+            yield struct.unpack_from(HISTORY_RECORD_FMT, buf)
+
+def injection_count(username):
+    """Nombre total d'injections (fichier binaire + journal non compacté)"""
+    return history_count(username) + len(journal_tail.get(username, ()))
+
+def iter_injection_history(username, start=0, stop=None):
+    """Parcourt l'historique complet [start, stop): fichier binaire puis fin du journal"""
+    count = history_count(username)
+    tail = journal_tail.get(username, ())
+    if stop is None:
+        stop = count + len(tail)
+    for record in history_iter(username, start, stop):
+        yield record
+    for i in range(max(0, start - count), max(0, stop - count)):
+        if i >= len(tail):
+            return
+        yield tail[i]
+
+def last_injection(username):
+    """Dernière injection du patient, ou None"""
+    tail = journal_tail.get(username)
+    if tail:
+        return tail[-1]
+    return history_read(username, history_count(username) - 1)
+
+def history_search(username, timestamp):
+    """Premier index dont le timestamp est >= timestamp (recherche dichotomique)"""
+    # L'historique est trié par date: le fichier sert lui-même d'index temporel
+    count = history_count(username)
+    lo, hi = 0, count
+    if count:
+        buf = bytearray(HISTORY_RECORD_SIZE)
+        with open(history_path(username), 'rb') as f:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                f.seek(HISTORY_HEADER_SIZE + mid * HISTORY_RECORD_SIZE)
+                f.readinto(buf)
+                if struct.unpack_from(HISTORY_RECORD_FMT, buf)[H_TIMESTAMP] < timestamp:
+                    lo = mid + 1
+                else:
+                    hi = mid
+    if lo < count:
+        return lo
+    
+    tail = journal_tail.get(username, ())
+    lo, hi = 0, len(tail)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if tail[mid][H_TIMESTAMP] < timestamp:
+            lo = mid + 1
+        else:
+            hi = mid
+    return count + lo
+
+def replay_journal():
+    """Rejoue les injections du journal absentes de l'historique binaire"""
+    global journal_seq, journal_pending
+    try:
+        f = open(JOURNAL_FILE, 'r')
+    except OSError:
+        return
+    
+    compacted_seq = {}  # {username: seq du dernier enregistrement binaire}
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Ligne incomplète (coupure pendant l'écriture): ignorée
+                continue
+            
+            username = entry["username"]
+            user = find_user(username)
+            if not user:
+                continue
+            if username not in compacted_seq:
+                last = history_read(username, history_count(username) - 1)
+                compacted_seq[username] = last[H_SEQ] if last else 0
+            
+            seq = entry["seq"]
+            record = (entry["timestamp"], entry["glucose"], entry["dose_mu"], entry["duration_ms"], seq)
+            if seq > user["rollups"]["seq"]:
+                # Agrégats pas encore sauvegardés avant la coupure
+                update_rollups(user, record)
+            if seq <= compacted_seq[username]:
+                # Déjà compactée avant une coupure
+                continue
+            
+            journal_tail.setdefault(username, []).append(record)
+            journal_seq = max(journal_seq, seq)
+            journal_pending += 1
+    
+    if journal_pending:
+        print(f"📒 {journal_pending} injection(s) récupérée(s) du journal")
+
+def compact_journal(force=False):
+    """Intègre le journal dans l'historique binaire (hors du traitement des requêtes)"""
+    global journal_pending
+    if not journal_pending or (not force and journal_pending < JOURNAL_COMPACT_THRESHOLD):
+        return
+    
+    # Les agrégats (mis à jour sans marquer users.json) doivent être sur disque
+    # avant que le journal ne disparaisse
+    if not save_users():
+        return
+    
+    # Chaque patient compacté quitte aussitôt le journal en mémoire: une erreur sur un autre
+    # patient ne fait pas réécrire ses enregistrements au prochain essai
+    for username in list(journal_tail):
+        records = journal_tail[username]
+        try:
+            history_append(username, records)
+        except OSError as e:
+            print(f"❌ Erreur compactage: {e}")
+            return
+        del journal_tail[username]
+        journal_pending -= len(records)
+    
+    # Les numéros de séquence rendent la suppression sûre même après une coupure
+    try:
+        os.remove(JOURNAL_FILE)
+    except OSError:
+        pass
+    print(f"🗜️ Journal compacté (seq={journal_seq})")
+
+def find_user(username):
+    """Recherche un utilisateur par son nom (index en mémoire)"""
+    return users_index.get(username)
+
+def register_user(username, password, email, age, weight):
+    """Enregistre un nouvel utilisateur"""
+    print(f"📝 Tentative d'inscription: {username}, {email}, age={age}, weight={weight}")
+    
+    # Vérifier si l'utilisateur existe déjà
+    if find_user(username):
+        print(f"❌ Utilisateur déjà existant: {username}")
+        return False, "Nom d'utilisateur déjà utilisé"
+    
+    # Convertir age et weight en int si ce sont des strings
+    try:
+        age = int(age)
+        weight = int(weight)
+    except (ValueError, TypeError) as e:
+        print(f"❌ Erreur de conversion: {e}")
+        return False, "Age et poids doivent être des nombres"
+    
+    # Créer le nouvel utilisateur
+    new_user = {
+        "username": username,
+        "password": password,  # En production, utiliser un hash!
+        "email": email,
+        "age": age,
+        "weight": weight,
+        "created_at": time.time(),
+        "rollups": {"seq": 0, "hourly": {}, "daily": {}}
+    }
+    
+    users_data["users"].append(new_user)
+    users_index[username] = new_user
+    mark_users_dirty()
+    
+    print(f"✅ Utilisateur enregistré: {username}")
+    return True, "Inscription réussie"
+
+def authenticate_user(username, password):
+    """Authentifie un utilisateur"""
+    user = find_user(username)
+    if user and user["password"] == password:
+        # Créer une session
+        session_id = str(time.ticks_ms())
+        active_sessions[session_id] = username
+        print(f"✅ Connexion réussie: {username}")
+        return True, session_id
+    return False, None
+
+def logout_user(session_id):
+    """Déconnecte un utilisateur"""
+    if session_id in active_sessions:
+        username = active_sessions[session_id]
+        del active_sessions[session_id]
+        print(f"👋 Déconnexion: {username}")
+        return True
+    return False
+
+def is_authenticated(session_id):
+    """Vérifie si une session est valide"""
+    return session_id in active_sessions
+
+def get_current_user(session_id):
+    """Récupère le nom d'utilisateur de la session"""
+    return active_sessions.get(session_id, None)
+
+def log_injection(username, glucose, dose_mu, duration_ms):
+    """Enregistre une injection dans l'historique du patient (dose en mU, durée en ms)
+
+    Retourne l'enregistrement ajouté, ou None si le patient est inconnu.
+    """
+    global journal_seq, journal_pending
+    user = find_user(username)
+    if user:
+        journal_seq += 1
+        timestamp = int(time.time())
+        
+        # Garder l'historique trié (l'horloge peut reculer après un reset sans NTP)
+        last = last_injection(username)
+        if last and last[H_TIMESTAMP] > timestamp:
+            timestamp = last[H_TIMESTAMP]
+        entry = {
+            "seq": journal_seq,
+            "username": username,
+            "timestamp": timestamp,
+            "glucose": glucose,
+            "dose_mu": dose_mu,
+            "duration_ms": duration_ms
+        }
+        try:
+            with open(JOURNAL_FILE, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"❌ Erreur journal: {e}")
+        
+        record = (timestamp, glucose, dose_mu, duration_ms, journal_seq)
+        journal_tail.setdefault(username, []).append(record)
+        journal_pending += 1
+        
+        # users.json n'est pas réécrit: replay_journal() réapplique les agrégats au démarrage
+        update_rollups(user, record)
+        return record
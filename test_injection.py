@@ -0,0 +1,155 @@
+"""Précision du contrôleur de délivrance sur l'hôte: machine simulé, horloge ticks_ms simulée
+
+    python -m pytest test_injection.py   (ou: python -m unittest test_injection)
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+import unittest
+
+class FakeClock:
+    """Horloge ticks_ms avancée à la main (repliement sur 30 bits comme sur l'ESP32)"""
+    PERIOD = 1 << 30
+
+    def __init__(self):
+        self.ms = 0
+
+    def ticks_ms(self):
+        return self.ms % self.PERIOD
+
+    def ticks_diff(self, a, b):
+        return (a - b + self.PERIOD // 2) % self.PERIOD - self.PERIOD // 2
+
+class FakePin:
+    OUT = 1
+
+    def __init__(self, pin, mode=None):
+        self.state = 0
+
+    def value(self, v=None):
+        if v is None:
+            return self.state
+        self.state = v
+
+class FakeADC:
+    ATTN_11DB = 3
+    WIDTH_12BIT = 3
+
+    def __init__(self, pin):
+        pass
+
+    def atten(self, attenuation):
+        pass
+
+    def width(self, width):
+        pass
+
+    def read(self):
+        return 2048
+
+class FakeTimer:
+    """Le callback n'est jamais appelé tout seul: le test pilote delivery_tick()"""
+    PERIODIC = 1
+
+    def __init__(self, timer_id):
+        pass
+
+    def init(self, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+clock = FakeClock()
+time.ticks_ms = clock.ticks_ms
+time.ticks_diff = clock.ticks_diff
+sys.modules["machine"] = types.SimpleNamespace(Pin=FakePin, ADC=FakeADC, Timer=FakeTimer)
+
+import injection  # noqa: E402
+import store  # noqa: E402
+
+class DeliveryControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.mkdtemp()
+        os.chdir(self.tmp)
+        with open(store.USERS_FILE, 'w') as f:
+            json.dump({"users": [{"username": "demo", "password": "x"}]}, f)
+        store.load_users()
+
+        clock.ms = (1 << 30) - 5000  # Repliement de ticks_ms pendant le bolus
+        injection.injection_in_progress = False
+        injection.injection_finished = False
+        injection.injection_stats.clear()
+        injection.overshoot_max_ms = 0
+        injection.tick_gap_max_ms = 0
+        injection.start_delivery_controller()
+
+    def tearDown(self):
+        injection.stop_delivery_controller()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmp)
+
+    def tick(self, ms):
+        clock.ms += ms
+        injection.delivery_tick(None)
+
+    def run_until_finished(self, periods):
+        """Ticks aux périodes données (en boucle) jusqu'à l'arrêt par le contrôleur"""
+        i = 0
+        while not injection.injection_finished:
+            self.assertLess(i, 100000)
+            self.tick(periods[i % len(periods)])
+            i += 1
+        injection.update_injection()
+
+    def test_bolus_stops_at_target(self):
+        self.assertTrue(injection.start_injection(1.234, "demo")[0])
+        self.assertEqual(injection.relay_pump.value(), 1)
+        self.run_until_finished([7])
+
+        # 12340 ms de marche nécessaires; premier tick à 7 ms près: 12341 ms
+        self.assertEqual(injection.injected_dose_mu, 1234)
+        self.assertEqual(injection.injection_stats[-1], {
+            "target": 1.234, "actual": 1.234, "on_ms": 12341, "overshoot_ms": 1, "reason": "target"})
+        record = store.last_injection("demo")
+        self.assertEqual((record[store.H_DOSE], record[store.H_DURATION]), (1234, 12341))
+        self.assertEqual(injection.relay_pump.value(), 0)
+
+    def test_manual_stop(self):
+        injection.start_injection(2.0, "demo")
+        for _ in range(50):
+            self.tick(20)
+        clock.ms += 5  # Arrêt demandé entre deux ticks
+        success, _ = injection.stop_injection("demo")
+
+        self.assertTrue(success)
+        self.assertEqual(injection.relay_pump.value(), 0)
+        self.assertEqual(injection.injected_dose_mu, 100)
+        self.assertEqual(injection.injection_stats[-1], {
+            "target": 2.0, "actual": 0.1, "on_ms": 1005, "overshoot_ms": 0, "reason": "manual"})
+        record = store.last_injection("demo")
+        self.assertEqual((record[store.H_DOSE], record[store.H_DURATION]), (100, 1005))
+
+    def test_uneven_ticks(self):
+        injection.start_injection(0.5, "demo")
+        self.run_until_finished([3, 41, 17, 250, 9])
+
+        stats = injection.injection_stats[-1]
+        # Dose réelle = durée de marche x débit, dépassement borné par le plus long intervalle
+        self.assertEqual(stats["actual"] * 1000, injection.delivered_dose_mu(stats["on_ms"]))
+        self.assertGreaterEqual(injection.injected_dose_mu, 500)
+        self.assertEqual(stats["overshoot_ms"], stats["on_ms"] - 5000)
+        self.assertLess(stats["overshoot_ms"], 250)
+        self.assertEqual(injection.tick_gap_max_ms, 250)
+        self.assertEqual(injection.overshoot_max_ms, stats["overshoot_ms"])
+        record = store.last_injection("demo")
+        self.assertEqual(record[store.H_DOSE], injection.injected_dose_mu)
+
+if __name__ == "__main__":
+    unittest.main()